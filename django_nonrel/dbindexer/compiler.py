@@ -27,6 +27,10 @@ class SQLCompiler(BaseCompiler):
         self.convert_filters()
         return super(SQLCompiler, self).results_iter()
 
+    def start_fetch(self):
+        self.convert_filters()
+        return super(SQLCompiler, self).start_fetch()
+
     def has_results(self):
         self.convert_filters()
         return super(SQLCompiler, self).has_results()
@@ -1,3 +1,4 @@
+import datetime
 from functools import wraps
 import sys
 
@@ -8,13 +9,16 @@ from django.db.models.sql.where import AND, OR
 from django.db.utils import DatabaseError, IntegrityError
 from django.utils.tree import Node
 
-from google.appengine.api.datastore import Entity, Query, MultiQuery, \
-    Put, Get, Delete
+from google.appengine.api import namespace_manager
+from google.appengine.api.datastore import Entity, Query, \
+    Put, PutAsync, Get, GetAsync, Delete, IsInTransaction
 from google.appengine.api.datastore_errors import Error as GAEError
-from google.appengine.api.datastore_types import Key, Text
+from google.appengine.api.datastore_types import Key, Text, \
+    RestoreFromIndexValue
 from google.appengine.datastore.datastore_query import Cursor
 
 from djangotoolbox.db.basecompiler import (
+    EmptyResultSet,
     NonrelQuery,
     NonrelCompiler,
     NonrelInsertCompiler,
@@ -24,8 +28,10 @@ from djangotoolbox.db.basecompiler import (
     NonrelDateCompiler,
     NonrelDateTimeCompiler)
 
+from . import cursors
 from .db_settings import get_model_indexes
 from .expressions import ExpressionEvaluator
+from .multiquery import ParallelMultiQuery
 from .utils import commit_locked
 
 
@@ -59,6 +65,29 @@ NEGATION_MAP = {
 # it from the lack of value.
 NOT_PROVIDED = object()
 
+# Number of entities fetched and written per RPC by batched updates.
+UPDATE_BATCH_SIZE = 100
+
+# Most entity groups a cross-group (XG) transaction can touch.
+XG_MAX_GROUPS = 25
+
+# Storage types (db_types) that projection queries can return, with the
+# types their values get restored as. Texts, blobs and lists can't be
+# projected: the first two aren't indexed, and a list property comes
+# back as one result per value.
+PROJECTION_TYPES = {
+    'key': Key,
+    'string': unicode,
+    'decimal': unicode,
+    'integer': long,
+    'long': long,
+    'float': float,
+    'bool': bool,
+    'date': datetime.datetime,
+    'time': datetime.datetime,
+    'datetime': datetime.datetime,
+}
+
 
 def safe_call(func):
     """
@@ -93,11 +122,13 @@ class GAEQuery(NonrelQuery):
         self.ordering = []
         self.db_table = self.query.get_meta().db_table
         self.pks_only = (len(fields) == 1 and fields[0].primary_key)
-        start_cursor = getattr(self.query, '_gae_start_cursor', None)
-        end_cursor = getattr(self.query, '_gae_end_cursor', None)
+        self.projected_fields = self._get_projected_fields(fields)
+        self.start_cursor = getattr(self.query, '_gae_start_cursor', None)
+        self.end_cursor = getattr(self.query, '_gae_end_cursor', None)
         self.config = getattr(self.query, '_gae_config', {})
         self.gae_query = [Query(self.db_table, keys_only=self.pks_only,
-                                cursor=start_cursor, end_cursor=end_cursor)]
+                                cursor=self.start_cursor,
+                                end_cursor=self.end_cursor)]
 
     # This is needed for debugging.
     def __repr__(self):
@@ -105,23 +136,44 @@ class GAEQuery(NonrelQuery):
 
     @safe_call
     def fetch(self, low_mark=0, high_mark=None):
-        query = self._build_query()
+        """
+        Sends the query RPC right away and returns an iterator over the
+        results; the datastore keeps fetching the following batches in
+        the background while they are consumed.
+        """
+        projection = self._get_projection()
+        return self._iter_entities(self._run(low_mark, high_mark, projection),
+                                   projection)
+
+    def _run(self, low_mark, high_mark, projection=None):
+        query = self._build_query(projection)
         executed = False
         if self.excluded_pks and high_mark is not None:
             high_mark += len(self.excluded_pks)
         if self.included_pks is not None:
-            results = self.get_matching_pk(low_mark, high_mark)
+            results = self._get_matching_pk_async(low_mark, high_mark)
         else:
             if high_mark is None or high_mark > low_mark:
                 kw = {}
                 if self.config:
                     kw.update(self.config)
 
-                if low_mark:
-                    kw['offset'] = low_mark
-                else:
+                if not low_mark:
                     low_mark = 0
 
+                # Resume deep slices from where an earlier slice of the
+                # same query ended, if known.
+                signature = self._cursor_signature(query, projection)
+                offset = low_mark
+                if signature and low_mark >= cursors.MIN_OFFSET:
+                    position, cursor = cursors.nearest(signature, low_mark)
+                    if cursor is not None:
+                        kw['start_cursor'] = cursor
+                        offset -= position
+
+                if offset:
+                    kw['offset'] = offset
+
                 if high_mark:
                     kw['limit'] = high_mark - low_mark
 
@@ -130,11 +182,51 @@ class GAEQuery(NonrelQuery):
             else:
                 results = ()
 
-        if executed and not isinstance(query, MultiQuery):
+        if executed and not isinstance(query, ParallelMultiQuery):
             def get_cursor():
                 return query.GetCursor()
             self.query._gae_cursor = get_cursor
 
+            # Only slices are worth remembering, they may be followed
+            # by the next one.
+            if signature and high_mark:
+                results = self._remember_cursor(results, signature,
+                                                low_mark, get_cursor)
+
+        return results
+
+    def _cursor_signature(self, query, projection):
+        """
+        Returns what identifies the query for the cursor cache, or None
+        if it isn't cached (see utils.cache_cursors) or can't be resumed
+        from a cursor.
+        """
+        if isinstance(query, ParallelMultiQuery) or not getattr(
+                self.query, '_gae_cursor_cache', False):
+            return None
+
+        def websafe(cursor):
+            return cursor.to_websafe_string() if cursor else None
+
+        return cursors.signature(
+            namespace_manager.get_namespace(), self.db_table,
+            sorted(query.items()), self.ordering, self.pks_only,
+            projection, websafe(self.start_cursor),
+            websafe(self.end_cursor))
+
+    def _remember_cursor(self, results, signature, position, get_cursor):
+        for result in results:
+            position += 1
+            yield result
+
+        # All results were read, so the cursor points after the last one.
+        if position >= cursors.MIN_OFFSET:
+            cursors.remember(signature, position, get_cursor())
+
+    def _iter_entities(self, results, projection=None):
+        # Entities fetched by key (included_pks) are always whole.
+        if self.included_pks is not None:
+            projection = None
         for entity in results:
             if isinstance(entity, Key):
                 key = entity
@@ -142,7 +234,7 @@ class GAEQuery(NonrelQuery):
                 key = entity.key()
             if key in self.excluded_pks:
                 continue
-            yield self._make_entity(entity)
+            yield self._make_entity(entity, projection)
 
     @safe_call
     def count(self, limit=NOT_PROVIDED):
@@ -159,6 +251,13 @@ class GAEQuery(NonrelQuery):
         kw = {}
         if limit is not NOT_PROVIDED:
             kw['limit'] = limit
+
+        # Sub-queries only need their keys to be told apart.
+        if len(self.gae_query) > 1:
+            queries = [self._rebuild(query, keys_only=True)
+                       for query in self.gae_query]
+            return ParallelMultiQuery(queries, []).Count(**kw)
+
         return self._build_query().Count(**kw)
 
     @safe_call
@@ -296,6 +395,8 @@ class GAEQuery(NonrelQuery):
                 query[key] = value
 
     def _combine_filters(self, field, op_values):
+        # The sub-queries don't take the cursors.
+        self.start_cursor = self.end_cursor = None
         gae_query = self.gae_query
         combined = []
         for query in gae_query:
@@ -307,35 +408,131 @@ class GAEQuery(NonrelQuery):
                 combined.append(self.gae_query[0])
         self.gae_query = combined
 
-    def _make_entity(self, entity):
+    def _make_entity(self, entity, projection=None):
         if isinstance(entity, Key):
             key = entity
             entity = {}
         else:
             key = entity.key()
 
+        # Projection queries return the values as they are stored in
+        # the index (e.g. datetimes as microseconds), turn them back
+        # into what a full fetch would give.
+        if projection:
+            for field in self.projected_fields:
+                db_type = self.connection.creation.db_type(field)
+                entity[field.column] = RestoreFromIndexValue(
+                    entity.get(field.column), PROJECTION_TYPES[db_type])
+
         entity[self.query.get_meta().pk.column] = key
         return entity
 
-    @safe_call
-    def _build_query(self):
+    def _get_projected_fields(self, fields):
+        """
+        Returns the fields to read with a projection query instead of
+        fetching whole entities, or None if the query needs the whole
+        entities anyway or some of the fields can't be projected.
+        Only querysets passed through utils.project are projected.
+        """
+        if self.pks_only or not getattr(self.query, '_gae_projection',
+                                        False):
+            return None
+
+        # The key comes with every result.
+        fields = [field for field in fields if not field.primary_key]
+        all_fields = [field for field in self.query.get_meta().fields
+                      if not field.primary_key]
+        if not fields or len(fields) >= len(all_fields):
+            return None
+
+        unindexed = get_model_indexes(self.query.model)['unindexed']
+        for field in fields:
+            if field.name in unindexed or field.attname in unindexed:
+                return None
+            if self.connection.creation.db_type(field) not in \
+                    PROJECTION_TYPES:
+                return None
+
+        return fields
+
+    def _get_projection(self):
+        """
+        Returns the properties to project the query on, or None to
+        fetch whole entities: properties filtered for equality can't
+        be projected, and merging sub-queries needs the properties
+        they are ordered by.
+        """
+        if not self.projected_fields:
+            return None
+
+        columns = tuple(field.column for field in self.projected_fields)
+
         for query in self.gae_query:
-            query.Order(*self.ordering)
+            for column in columns:
+                if '%s =' % column in query:
+                    return None
+
         if len(self.gae_query) > 1:
-            return MultiQuery(self.gae_query, self.ordering)
-        return self.gae_query[0]
+            for column, _ in self.ordering:
+                if column != '__key__' and column not in columns:
+                    return None
 
-    def get_matching_pk(self, low_mark=0, high_mark=None):
-        if not self.included_pks:
-            return []
+        return columns
+
+    @safe_call
+    def _build_query(self, projection=None):
+        queries = self.gae_query
+        if projection:
+            queries = [self._rebuild(query, projection=projection)
+                       for query in queries]
+
+        # Keys only results can't be merged by anything but their key.
+        elif self.pks_only and len(queries) > 1 and [
+                column for column, _ in self.ordering
+                if column != '__key__']:
+            queries = [self._rebuild(query) for query in queries]
+
+        for query in queries:
+            query.Order(*self.ordering)
+        if len(queries) > 1:
+            return ParallelMultiQuery(queries, self.ordering)
+        return queries[0]
 
-        config = self.config.copy()
+    def _rebuild(self, query, **options):
+        rebuilt = Query(self.db_table, cursor=self.start_cursor,
+                        end_cursor=self.end_cursor, **options)
+        rebuilt.update(query)
+        return rebuilt
+
+    def _get_config(self):
+        config = dict(self.config or {})
 
         # batch_size is not allowed for Gets
         if 'batch_size' in config:
             del config['batch_size']
 
-        results = [result for result in Get(self.included_pks, **config)
+        return config
+
+    def _get_matching_pk_async(self, low_mark, high_mark):
+        if not self.included_pks:
+            return []
+
+        rpc = GetAsync(self.included_pks, **self._get_config())
+
+        def results():
+            for entity in self.get_matching_pk(low_mark, high_mark,
+                                               rpc.get_result()):
+                yield entity
+        return results()
+
+    def get_matching_pk(self, low_mark=0, high_mark=None, entities=None):
+        if not self.included_pks:
+            return []
+
+        if entities is None:
+            entities = Get(self.included_pks, **self._get_config())
+
+        results = [result for result in entities
                    if result is not None and
                        self.matches_filters(result)]
         if self.ordering:
@@ -369,6 +566,29 @@ class SQLCompiler(NonrelCompiler):
     """
     query_class = GAEQuery
 
+    def results_iter(self):
+        # Picks up a query started by utils.prefetch_async.
+        prefetched = getattr(self.query, '_gae_prefetched', None)
+        if prefetched is None:
+            return super(SQLCompiler, self).results_iter()
+
+        del self.query._gae_prefetched
+        fields, results = prefetched
+        return (self._make_result(entity, fields) for entity in results)
+
+    def start_fetch(self):
+        """
+        Starts running the query and returns the fields and the results
+        iterator for results_iter to pick up later.
+        """
+        fields = self.get_fields()
+        try:
+            results = self.build_query(fields).fetch(
+                self.query.low_mark, self.query.high_mark)
+        except EmptyResultSet:
+            results = []
+        return fields, results
+
     def as_sql(self, *args, **kwargs):
         sql, params = super(SQLCompiler, self).as_sql(*args, **kwargs)
 
@@ -420,6 +640,12 @@ class SQLInsertCompiler(NonrelInsertCompiler, SQLCompiler):
             entity.update(properties)
             entity_list.append(entity)
 
+        # Started by utils.bulk_create_async: leave the RPC on the query
+        # instead of waiting for the keys.
+        if getattr(self.query, '_gae_put_async', False):
+            self.query._gae_put_rpc = PutAsync(entity_list)
+            return None
+
         keys = Put(entity_list)
         return keys[0] if isinstance(keys, list) else keys
 
@@ -436,17 +662,85 @@ class SQLUpdateCompiler(NonrelUpdateCompiler, SQLCompiler):
         return len(pks)
 
     def update_entities(self, pks, pk_field):
-        for pk in pks:
-            self.update_entity(pk[0], pk_field)
-
-    @commit_locked
-    def update_entity(self, pk, pk_field):
+        """
+        Updates the entities in batches: one multi-key Get and one
+        multi-entity Put per UPDATE_BATCH_SIZE entities. The batches
+        aren't transactional on their own; use utils.lock_updates to
+        update each batch of up to XG_MAX_GROUPS entity groups in a
+        cross-group transaction of its own.
+
+        Within commit_locked(xg=True) the whole update is part of the
+        surrounding transaction, so it can't touch more than
+        XG_MAX_GROUPS entity groups (or more than one without xg).
+        """
         gae_query = self.build_query()
-        entity = Get(self.ops.value_for_db(pk, pk_field))
+        keys = [self.ops.value_for_db(pk[0], pk_field) for pk in pks]
+
+        if IsInTransaction():
+            groups = set(self._entity_group(key) for key in keys)
+            if len(groups) > XG_MAX_GROUPS:
+                raise DatabaseError("Can't update %d entity groups in a "
+                                    "transaction, at most %d can be "
+                                    "updated." %
+                                    (len(groups), XG_MAX_GROUPS))
+            for batch in self._group_batches(keys):
+                self.update_batch(gae_query, batch)
+        elif getattr(self.query, '_gae_locked_updates', False):
+            for batch in self._group_batches(keys):
+                self.update_locked_batch(gae_query, batch)
+        else:
+            for start in range(0, len(keys), UPDATE_BATCH_SIZE):
+                self.update_batch(gae_query,
+                                  keys[start:start + UPDATE_BATCH_SIZE])
 
-        if not gae_query.matches_filters(entity):
-            return
+    def _entity_group(self, key):
+        while key.parent() is not None:
+            key = key.parent()
+        return key
+
+    def _group_batches(self, keys):
+        """
+        Splits the keys into batches of at most XG_MAX_GROUPS entity
+        groups (and UPDATE_BATCH_SIZE entities), keeping the entities
+        of a group together.
+        """
+        groups = {}
+        for key in keys:
+            groups.setdefault(self._entity_group(key), []).append(key)
+
+        batches = []
+        batch, batch_groups = [], 0
+        for group in groups.values():
+            if batch and (batch_groups == XG_MAX_GROUPS or
+                          len(batch) + len(group) > UPDATE_BATCH_SIZE):
+                batches.append(batch)
+                batch, batch_groups = [], 0
+            batch.extend(group)
+            batch_groups += 1
+        if batch:
+            batches.append(batch)
+        return batches
 
+    @safe_call
+    def update_batch(self, gae_query, keys):
+        entities = [entity for entity in Get(keys)
+                    if entity is not None and
+                        gae_query.matches_filters(entity)]
+
+        for entity in entities:
+            self.update_values(entity)
+
+        if entities:
+            Put(entities)
+
+    @commit_locked(xg=True)
+    def update_locked_batch(self, gae_query, keys):
+        self.update_batch(gae_query, keys)
+
+    def update_values(self, entity):
+        """
+        Applies the new field values (and expressions) to the entity.
+        """
         for field, _, value in self.query.values:
             if hasattr(value, 'prepare_database_save'):
                 value = value.prepare_database_save(field)
@@ -464,8 +758,6 @@ class SQLUpdateCompiler(NonrelUpdateCompiler, SQLCompiler):
 
             entity[field.column] = self.ops.value_for_db(value, field)
 
-        Put(entity)
-
 
 class SQLDeleteCompiler(NonrelDeleteCompiler, SQLCompiler):
     pass
@@ -0,0 +1,69 @@
+"""
+Remembers where sliced queries ended, so that a later slice of the same
+query starting at or after that point resumes from a cursor instead of
+having the datastore skip over every entity before it (offsets are
+skipped one by one, and billed as reads). This makes paging through a
+query in order cost about a page per page, however deep it goes.
+
+Only used for querysets passed through utils.cache_cursors. The cursors
+are kept in memcache for a few minutes, by query signature and by
+position in its results. Entities added or deleted before a remembered
+position in the meantime shift the following slices by as many
+entities compared to offsets.
+"""
+
+import hashlib
+
+from google.appengine.api import memcache
+from google.appengine.datastore.datastore_query import Cursor
+
+
+# Smaller offsets are cheap enough to skip.
+MIN_OFFSET = 100
+
+# Positions remembered per query.
+MAX_CURSORS = 20
+
+TIMEOUT = 5 * 60
+
+NAMESPACE = 'djangoappengine.cursors'
+
+
+def signature(*parts):
+    """
+    Returns a key identifying a query by the given parts (which have
+    to repr() the same for the same query).
+    """
+    return hashlib.sha1(repr(parts)).hexdigest()
+
+
+def nearest(signature, position):
+    """
+    Returns the furthest remembered position of the query at or before
+    the given one and the cursor for it, or (0, None) if there is none.
+    """
+    cursors = memcache.get(signature, namespace=NAMESPACE) or {}
+    positions = [known for known in cursors if known <= position]
+    if not positions:
+        return 0, None
+
+    known = max(positions)
+    return known, Cursor.from_websafe_string(cursors[known])
+
+
+def remember(signature, position, cursor):
+    """
+    Remembers the cursor pointing after the first `position` results
+    of the query.
+    """
+    if cursor is None:
+        return
+
+    cursors = memcache.get(signature, namespace=NAMESPACE) or {}
+    cursors[position] = cursor.to_websafe_string()
+
+    # The nearer to the start, the less a cursor saves.
+    for known in sorted(cursors)[:-MAX_CURSORS]:
+        del cursors[known]
+
+    memcache.set(signature, cursors, TIMEOUT, namespace=NAMESPACE)
@@ -0,0 +1,133 @@
+"""
+Runs the sub-queries that __in and negated __exact filters are split
+into all at once, and merges their results.
+
+Each sub-query's first batch is requested as soon as it's run (as an
+asynchronous RPC), so the sub-queries are waited on together instead
+of one after another. Their results are then merged in the requested
+order, skipping entities returned by more than one sub-query, and no
+more of them are read than needed for the slice asked for.
+"""
+
+import heapq
+
+from google.appengine.api.datastore import Query
+from google.appengine.api.datastore_types import Key
+
+
+class Descending(object):
+    """
+    Wraps a value to sort it in reverse order.
+    """
+
+    def __init__(self, value):
+        self.value = value
+
+    def __cmp__(self, other):
+        return cmp(other.value, self.value)
+
+
+class ParallelMultiQuery(object):
+    """
+    A stand-in for the SDK's MultiQuery that also takes keys only
+    sub-queries, as long as they are only ordered by key.
+    """
+
+    def __init__(self, queries, ordering):
+        self.queries = queries
+        self.ordering = ordering
+
+    def __repr__(self):
+        return '<ParallelMultiQuery: %r ORDER %r>' % (self.queries,
+                                                     self.ordering)
+
+    def Run(self, offset=0, limit=None, **config):
+        # Any of the sub-queries may hold all of the results up to the
+        # end of the slice.
+        if limit is not None:
+            config['limit'] = offset + limit
+
+        results = [query.Run(**config) for query in self.queries]
+        return self._merge(results, offset, limit)
+
+    def Count(self, limit=None, **config):
+        """
+        Counts the results of the sub-queries, each counted once. The
+        sub-queries are best keys only and unordered for this, see
+        GAEQuery.count.
+        """
+        if limit is not None:
+            config['limit'] = limit
+
+        results = [query.Run(**config) for query in self.queries]
+
+        keys = set()
+        for iterator in results:
+            for result in iterator:
+                keys.add(result if isinstance(result, Key) else result.key())
+                if limit is not None and len(keys) >= limit:
+                    return limit
+        return len(keys)
+
+    def _merge(self, results, offset, limit):
+        heap = []
+        for index, iterator in enumerate(results):
+            self._push(heap, index, iterator)
+
+        seen = set()
+        returned = 0
+        pending = None
+        while True:
+            if limit is not None and returned >= limit:
+                return
+
+            # Only read on from the sub-query that gave the last result
+            # if more results are needed, it may take another RPC.
+            if pending is not None:
+                self._push(heap, *pending)
+            if not heap:
+                return
+
+            _, key, index, result, iterator = heapq.heappop(heap)
+            pending = (index, iterator)
+
+            if key in seen:
+                continue
+            seen.add(key)
+
+            if offset:
+                offset -= 1
+                continue
+
+            yield result
+            returned += 1
+
+    def _push(self, heap, index, iterator):
+        for result in iterator:
+            key = result if isinstance(result, Key) else result.key()
+            # Entities sort by key last, like in the datastore; the
+            # index keeps results from being compared.
+            heapq.heappush(heap, (self._sort_key(result, key), key, index,
+                                  result, iterator))
+            return
+
+    def _sort_key(self, result, key):
+        values = []
+        for column, direction in self.ordering:
+            if column == '__key__':
+                value = key
+            else:
+                value = result.get(column)
+
+                # Lists sort by their smallest value going up, and by
+                # their largest one going down.
+                if isinstance(value, list):
+                    if direction == Query.DESCENDING:
+                        value = max(value)
+                    else:
+                        value = min(value)
+
+            if direction == Query.DESCENDING:
+                value = Descending(value)
+            values.append(value)
+        return tuple(values)
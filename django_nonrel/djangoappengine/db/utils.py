@@ -12,6 +12,9 @@ class CursorQueryMixin(object):
         kwargs['_gae_start_cursor'] = getattr(self, '_gae_start_cursor', None)
         kwargs['_gae_end_cursor'] = getattr(self, '_gae_end_cursor', None)
         kwargs['_gae_config'] = getattr(self, '_gae_config', None)
+        kwargs['_gae_locked_updates'] = getattr(self, '_gae_locked_updates', False)
+        kwargs['_gae_projection'] = getattr(self, '_gae_projection', False)
+        kwargs['_gae_cursor_cache'] = getattr(self, '_gae_cursor_cache', False)
         return super(CursorQueryMixin, self).clone(*args, **kwargs)
 
 def _add_mixin(queryset):
@@ -58,6 +61,80 @@ def set_config(queryset, **kwargs):
     setattr(queryset.query, '_gae_config', kwargs)
     return queryset
 
+def prefetch_async(queryset):
+    """
+    Starts running the query right away instead of when the queryset
+    is first iterated, so several querysets can be in flight at once:
+
+        hooks = prefetch_async(EmailHook.objects.filter(...))
+        logs = prefetch_async(LogEntry.objects.filter(...)[:25])
+        # both queries run concurrently from here on
+
+    The results are picked up when the returned queryset is evaluated.
+    Querysets derived from it (by filtering, slicing, ...) run their
+    own query as usual.
+    """
+    queryset = _add_mixin(queryset)
+    compiler = queryset.query.get_compiler(using=queryset.db)
+    queryset.query._gae_prefetched = compiler.start_fetch()
+    return queryset
+
+def lock_updates(queryset):
+    """
+    Makes update() on the queryset update its entities in cross-group
+    transactions of up to 25 entity groups each, so concurrent updates
+    (like F() increments) to the same entity can't get lost.
+    """
+    queryset = _add_mixin(queryset)
+    setattr(queryset.query, '_gae_locked_updates', True)
+    return queryset
+
+def project(queryset):
+    """
+    Makes values(), values_list() and only() on the queryset read just
+    the selected fields with a projection query, if they are indexed.
+
+    Projections filtered or ordered on other properties, or on more
+    than one property, need a composite index in index.yaml. They also
+    skip entities that don't have all of the selected properties (like
+    ones saved before a field was added to the model).
+    """
+    queryset = _add_mixin(queryset)
+    setattr(queryset.query, '_gae_projection', True)
+    return queryset
+
+def cache_cursors(queryset):
+    """
+    Makes deep slices of the queryset (like later pages) resume from
+    where an earlier slice of the same query ended, if that's known,
+    instead of skipping an offset (see cursors.py).
+
+    Entities added or deleted before such a point in the meantime
+    shift the slice by as many entities compared to an offset, so only
+    use it where that doesn't matter.
+    """
+    queryset = _add_mixin(queryset)
+    setattr(queryset.query, '_gae_cursor_cache', True)
+    return queryset
+
+def bulk_create_async(objs, using=DEFAULT_DB_ALIAS):
+    """
+    Like QuerySet.bulk_create(), but starts a single multi-entity Put
+    for the given instances (all of the same model) without waiting
+    for it. Returns the datastore RPC, call get_result() on it to wait
+    for the keys.
+    """
+    from django.db.models import sql
+
+    # Unlike SQL back-ends, instances without a pk can be put together
+    # with the others and just get a new key.
+    model = objs[0].__class__
+    query = sql.InsertQuery(model)
+    query.insert_values(model._meta.local_fields, objs)
+    query._gae_put_async = True
+    query.get_compiler(using=using).execute_sql()
+    return query._gae_put_rpc
+
 def commit_locked(func_or_using=None, retries=None, xg=False, propagation=None):
     """
     Decorator that locks rows on DB reads.
@@ -0,0 +1,137 @@
+import collections
+
+from django.core.paginator import InvalidPage
+
+from google.appengine.datastore.datastore_query import Cursor
+
+from .db.utils import get_cursor, set_cursor
+
+
+class InvalidCursor(InvalidPage):
+    pass
+
+
+class CursorPaginator(object):
+    """
+    Paginates a QuerySet with datastore cursors instead of offsets, so
+    every page costs the same no matter how deep it is.
+
+    Pages are addressed by opaque tokens (see CursorPage.next_token and
+    CursorPage.previous_token) instead of page numbers. There's no
+    count() either, as that would have to walk the whole result set.
+    The query needs a stable ordering, and going back needs the index
+    for the reversed ordering too.
+    """
+
+    def __init__(self, object_list, per_page):
+        self.object_list = object_list
+        self.per_page = int(per_page)
+
+    def page(self, token=None):
+        """
+        Returns the CursorPage for the given token, or the first page if
+        no token is given.
+        """
+        if not token:
+            return self._forward(None)
+
+        direction, cursor = token[:1], token[1:]
+        try:
+            Cursor.from_websafe_string(cursor)
+        except Exception:
+            raise InvalidCursor('That page token is not valid')
+
+        if direction == 'n':
+            return self._forward(cursor)
+        if direction == 'p':
+            return self._backward(cursor)
+        raise InvalidCursor('That page token is not valid')
+
+    def _has_more(self, queryset, start):
+        if start is None:
+            return False
+        return bool(list(set_cursor(queryset, start=start)[:1]))
+
+    def _forward(self, start):
+        page = self.object_list[:self.per_page]
+        if start is not None:
+            page = set_cursor(page, start=start)
+
+        objects = list(page)
+        end = get_cursor(page) if objects else None
+
+        has_next = (len(objects) == self.per_page and
+                    self._has_more(self.object_list, end))
+
+        return CursorPage(objects, self,
+                          start=start, end=end,
+                          has_previous=start is not None,
+                          has_next=has_next)
+
+    def _backward(self, start):
+        # Walk the reversed query from where the newer page started.
+        queryset = self.object_list.reverse()
+        page = set_cursor(queryset[:self.per_page], start=_reverse(start))
+
+        objects = list(page)
+        objects.reverse()
+        end = get_cursor(page) if objects else None
+
+        has_previous = (len(objects) == self.per_page and
+                        self._has_more(queryset, end))
+
+        return CursorPage(objects, self,
+                          start=_reverse(end) if end else None, end=start,
+                          has_previous=has_previous,
+                          has_next=True)
+
+
+def _reverse(websafe_cursor):
+    cursor = Cursor.from_websafe_string(websafe_cursor)
+    return cursor.reversed().to_websafe_string()
+
+
+class CursorPage(collections.Sequence):
+    """
+    A page of a CursorPaginator; behaves like django.core.paginator.Page
+    as far as templates are concerned, minus the page numbers.
+    """
+
+    def __init__(self, object_list, paginator, start=None, end=None,
+                 has_previous=False, has_next=False):
+        self.object_list = object_list
+        self.paginator = paginator
+        self.start_cursor = start
+        self.end_cursor = end
+        self._has_previous = has_previous and start is not None
+        self._has_next = has_next and end is not None
+
+    def __repr__(self):
+        return '<Page of %s items>' % len(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self._has_next
+
+    def has_previous(self):
+        return self._has_previous
+
+    def has_other_pages(self):
+        return self.has_previous() or self.has_next()
+
+    @property
+    def next_token(self):
+        if self.has_next():
+            return 'n' + self.end_cursor
+        return None
+
+    @property
+    def previous_token(self):
+        if self.has_previous():
+            return 'p' + self.start_cursor
+        return None
@@ -6,4 +6,5 @@ from .test_keys import KeysTest
 from .test_mapreduce import DjangoModelInputReaderTest, DjangoModelIteratorTest
 from .test_not_return_sets import NonReturnSetsTest
 from .test_order import OrderTest
+from .test_paginator import CursorPaginatorTest
 from .test_transactions import TransactionTest
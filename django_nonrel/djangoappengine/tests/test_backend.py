@@ -29,3 +29,128 @@ class BackendTest(TestCase):
         self.assertEqual(A.objects.all()[0].value, 3)
         self.assertRaises(DatabaseError, B.objects.count)
         self.assertRaises(DatabaseError, lambda: B.objects.all()[0])
+
+    def test_bulk_create_async(self):
+        from djangoappengine.db.utils import bulk_create_async
+
+        rpc = bulk_create_async([A(value=1), A(value=2), A(value=3)])
+        self.assertEqual(len(rpc.get_result()), 3)
+        self.assertEqual(A.objects.count(), 3)
+        self.assertEqual(
+            sorted(A.objects.values_list('value', flat=True)), [1, 2, 3])
+
+    def test_prefetch_async(self):
+        from djangoappengine.db.utils import prefetch_async
+
+        objs = [A(value=value) for value in range(5)]
+        for obj in objs:
+            obj.save()
+
+        ordered = prefetch_async(A.objects.order_by('value')[1:4])
+        by_pk = prefetch_async(A.objects.filter(pk__in=[objs[0].pk,
+                                                       objs[4].pk]))
+        values = prefetch_async(A.objects.filter(value__gte=3).values_list(
+            'value', flat=True))
+
+        # all three are running now, their results come in when used
+        self.assertEqual([obj.value for obj in ordered], [1, 2, 3])
+        self.assertEqual(sorted(obj.value for obj in by_pk), [0, 4])
+        self.assertEqual(sorted(values), [3, 4])
+
+        # querysets derived from a prefetched one run their own query
+        queryset = prefetch_async(A.objects.all())
+        self.assertEqual(queryset.filter(value=2).count(), 1)
+        self.assertEqual(
+            [obj.value for obj in queryset.order_by('-value')[:2]], [4, 3])
+        self.assertEqual(len(queryset), 5)
+
+    def test_projection(self):
+        import datetime
+        from djangoappengine.db.utils import project
+        from .models import DateTimeModel, EmailModel, \
+            FieldsWithoutOptionsModel
+
+        def projection(queryset):
+            compiler = queryset.query.get_compiler(using=queryset.db)
+            return compiler.build_query(compiler.get_fields())._get_projection()
+
+        EmailModel(email='a@example.com', number=1).save()
+        EmailModel(email='b@example.com', number=2).save()
+
+        # only querysets that ask for it are projected
+        self.assertEqual(projection(EmailModel.objects.values_list('email')),
+                         None)
+
+        queryset = project(EmailModel.objects.order_by('number'))
+        self.assertEqual(projection(queryset.values_list('email')),
+                         ('email',))
+        self.assertEqual(list(queryset.values_list('email', flat=True)),
+                         [u'a@example.com', u'b@example.com'])
+        self.assertEqual([obj.number for obj in queryset.only('number')],
+                         [1, 2])
+
+        # projected values are converted back from their index values
+        when = datetime.datetime(2013, 5, 1, 12, 30, 15, 250)
+        DateTimeModel(datetime=when).save()
+        queryset = project(DateTimeModel.objects.all()).values_list(
+            'datetime', flat=True)
+        self.assertEqual(projection(queryset), ('datetime',))
+        self.assertEqual(list(queryset), [when])
+
+        # properties filtered for equality can't be projected
+        queryset = project(EmailModel.objects.filter(
+            number=2)).values_list('number')
+        self.assertEqual(projection(queryset), None)
+        self.assertEqual(list(queryset), [(2,)])
+        self.assertEqual(projection(project(EmailModel.objects.filter(
+            number__gt=1)).values_list('number')), ('number',))
+
+        # neither can unindexed ones, nor whole entities
+        self.assertEqual(projection(project(
+            FieldsWithoutOptionsModel.objects.all()).values_list('long_text')),
+            None)
+        self.assertEqual(projection(project(EmailModel.objects.all())), None)
+
+    def test_cursor_cache(self):
+        from ..db import cursors
+        from ..db.utils import cache_cursors
+        from .models import OrderedModel
+
+        for pk in range(1, 11):
+            OrderedModel(pk=pk, priority=pk).save()
+
+        resumed = []
+        nearest = cursors.nearest
+
+        def record_nearest(signature, position):
+            known, cursor = nearest(signature, position)
+            resumed.append(known)
+            return known, cursor
+
+        old_min_offset = cursors.MIN_OFFSET
+        cursors.MIN_OFFSET = 2
+        cursors.nearest = record_nearest
+        try:
+            queryset = cache_cursors(OrderedModel.objects.order_by('priority'))
+
+            def priorities(low, high):
+                return [obj.priority for obj in queryset[low:high]]
+
+            self.assertEqual(priorities(2, 4), [3, 4])
+            self.assertEqual(priorities(4, 6), [5, 6])
+            self.assertEqual(priorities(7, 9), [8, 9])
+            self.assertEqual(priorities(3, 5), [4, 5])
+            self.assertEqual(resumed, [0, 4, 6, 0])
+
+            # other queries don't share the cursors
+            self.assertEqual([obj.priority for obj in cache_cursors(
+                OrderedModel.objects.all())[6:8]], [4, 3])
+            self.assertEqual(resumed[-1], 0)
+
+            # and only querysets that ask for it use the cache
+            self.assertEqual([obj.priority for obj in OrderedModel.objects
+                              .order_by('priority')[4:6]], [5, 6])
+            self.assertEqual(len(resumed), 5)
+        finally:
+            cursors.MIN_OFFSET = old_min_offset
+            cursors.nearest = nearest
@@ -378,6 +378,30 @@ class FilterTest(TestCase):
         orders = [post.order for post in posts]
         self.assertEqual(orders, range(5, 0, -1))
 
+    def test_in_with_slice(self):
+        queryset = FieldsWithOptionsModel.objects.filter(
+            integer__in=[1, 2, 5, 9]).order_by('-floating_point')
+        self.assertEquals(
+            [entity.floating_point for entity in queryset[1:3]], [5.3, 2.6])
+        self.assertEquals(queryset.count(), 4)
+
+        # Keys only sub-queries get merged too.
+        self.assertEquals(
+            list(queryset.values_list('pk', flat=True)[:2]),
+            ['rinnengan@sage.de', 'app-engine@scholardocs.com'])
+        self.assertEquals(OrderedModel.objects.filter(
+            priority__in=[0, 1]).update(priority=5), 2)
+
+        # Entities matched by more than one sub-query come up once.
+        self.assertEquals(
+            [entity.integer for entity in FieldsWithOptionsModel.objects
+                .filter(integer__in=[5, 9, 5]).order_by('integer')],
+            [5, 9])
+        self.assertEquals(FieldsWithOptionsModel.objects.filter(
+            integer__in=[5, 9, 5]).count(), 2)
+        self.assertEquals(FieldsWithOptionsModel.objects.exclude(
+            integer=5).count(), 3)
+
     def test_inequality(self):
         self.assertEquals(
             [entity.email for entity in FieldsWithOptionsModel.objects
@@ -0,0 +1,50 @@
+from django.test import TestCase
+
+from ..paginator import CursorPaginator, InvalidCursor
+from .models import OrderedModel
+
+
+class CursorPaginatorTest(TestCase):
+
+    def setUp(self):
+        for pk in range(1, 8):
+            OrderedModel(pk=pk, priority=pk).save()
+
+    def priorities(self, page):
+        return [item.priority for item in page]
+
+    def test_forward(self):
+        paginator = CursorPaginator(OrderedModel.objects.all(), 3)
+
+        page = paginator.page()
+        self.assertEquals(self.priorities(page), [7, 6, 5])
+        self.assertFalse(page.has_previous())
+        self.assertTrue(page.has_next())
+
+        page = paginator.page(page.next_token)
+        self.assertEquals(self.priorities(page), [4, 3, 2])
+        self.assertTrue(page.has_previous())
+        self.assertTrue(page.has_next())
+
+        page = paginator.page(page.next_token)
+        self.assertEquals(self.priorities(page), [1])
+        self.assertTrue(page.has_previous())
+        self.assertFalse(page.has_next())
+        self.assertEquals(page.next_token, None)
+
+    def test_backward(self):
+        paginator = CursorPaginator(OrderedModel.objects.all(), 3)
+        last = paginator.page(paginator.page(
+            paginator.page().next_token).next_token)
+
+        page = paginator.page(last.previous_token)
+        self.assertEquals(self.priorities(page), [4, 3, 2])
+        self.assertTrue(page.has_next())
+
+        page = paginator.page(page.previous_token)
+        self.assertEquals(self.priorities(page), [7, 6, 5])
+        self.assertFalse(page.has_previous())
+
+    def test_invalid_token(self):
+        paginator = CursorPaginator(OrderedModel.objects.all(), 3)
+        self.assertRaises(InvalidCursor, paginator.page, 'x-not-a-cursor')
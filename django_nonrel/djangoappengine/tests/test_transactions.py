@@ -1,6 +1,9 @@
 from django.db.models import F
+from django.db.utils import DatabaseError
 from django.test import TestCase
 
+from ..db import compiler
+from ..db.utils import commit_locked, lock_updates
 from .models import EmailModel
 
 
@@ -56,3 +59,58 @@ class TransactionTest(TestCase):
         self.assertEqual(1, len(EmailModel.objects.all().filter(number=294)))
 
        # TODO: Tests for: sub, muld, div, mod, ....
+
+    def test_batched_update(self):
+        batch_size = compiler.UPDATE_BATCH_SIZE
+        compiler.UPDATE_BATCH_SIZE = 2
+        try:
+            for number in range(4, 9):
+                EmailModel(email=self.emails[2], number=number).save()
+
+            EmailModel.objects.filter(email=self.emails[2]).update(
+                number=F('number') + 100, email=self.emails[3])
+        finally:
+            compiler.UPDATE_BATCH_SIZE = batch_size
+
+        self.assertEqual(
+            range(104, 109),
+            sorted(EmailModel.objects.filter(
+                email=self.emails[3]).values_list('number', flat=True)))
+
+        # the rest is left alone
+        self.assertEqual(0, len(EmailModel.objects.filter(
+            email=self.emails[2])))
+        self.assertEqual(1, len(EmailModel.objects.filter(number=1)))
+
+    def test_locked_update(self):
+        max_groups = compiler.XG_MAX_GROUPS
+        compiler.XG_MAX_GROUPS = 1
+        try:
+            lock_updates(EmailModel.objects.filter(
+                email=self.emails[0])).update(number=F('number') + 1)
+        finally:
+            compiler.XG_MAX_GROUPS = max_groups
+
+        self.assertEqual([2, 3], sorted(EmailModel.objects.filter(
+            email=self.emails[0]).values_list('number', flat=True)))
+
+    def test_update_in_transaction(self):
+        pks = list(EmailModel.objects.filter(
+            email=self.emails[0]).values_list('pk', flat=True))
+
+        @commit_locked(xg=True)
+        def update():
+            EmailModel.objects.filter(pk__in=pks).update(
+                number=F('number') + 10)
+
+        update()
+        self.assertEqual([11, 12], sorted(EmailModel.objects.filter(
+            email=self.emails[0]).values_list('number', flat=True)))
+
+        # more entity groups than a transaction can hold fail up front
+        max_groups = compiler.XG_MAX_GROUPS
+        compiler.XG_MAX_GROUPS = 1
+        try:
+            self.assertRaises(DatabaseError, update)
+        finally:
+            compiler.XG_MAX_GROUPS = max_groups
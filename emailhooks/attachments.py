@@ -0,0 +1,97 @@
+import base64
+import hashlib
+import hmac
+import time
+import urllib
+import urlparse
+
+from django.conf import settings
+from django.core.files.base import File
+from django.core.files.storage import default_storage
+from django.core.urlresolvers import reverse
+from django.utils.crypto import constant_time_compare
+
+from google.appengine.ext import deferred
+
+
+# Hooks with offload_attachments on get attachments bigger than this as
+# a signed, expiring download link instead of inline base64.
+OFFLOAD_THRESHOLD = 100 * 1000
+
+# how long download links work, the blobs are removed afterwards
+URL_TTL = 7 * 24 * 60 * 60
+
+
+# Feeds the attachment's base64 chunks to the storage backend decoded,
+# without joining them up first. The chunks are left in place, other
+# hooks may still want the attachment inline.
+class Base64File(File):
+    def __init__(self, chunks, name):
+        super(Base64File, self).__init__(None, name)
+        self.base64_chunks = chunks
+
+    @property
+    def size(self):
+        return sum(len(chunk) for chunk in self.base64_chunks) * 3 // 4
+
+    def chunks(self, chunk_size=None):
+        # decode in multiples of 4 characters so the chunks join up
+        remainder = ''
+
+        for chunk in self.base64_chunks:
+            data = remainder + chunk
+            cut = len(data) - len(data) % 4
+            remainder = data[cut:]
+
+            if cut:
+                yield base64.b64decode(data[:cut])
+
+        if remainder:
+            yield base64.b64decode(remainder + '=' * (-len(remainder) % 4))
+
+
+def offload(email, base_url, threshold=OFFLOAD_THRESHOLD):
+    expires = int(time.time()) + URL_TTL
+
+    for attachment in email.attachments:
+        content = Base64File(
+            attachment['payload'], attachment['filename'] or 'attachment')
+
+        if content.size <= threshold or 'url' in attachment:
+            continue
+
+        name = default_storage.save(content.name, content)
+        deferred.defer(delete, name, _countdown=URL_TTL)
+
+        attachment['size'] = content.size
+        attachment['url'] = urlparse.urljoin(base_url, '%s?%s' % (
+            reverse('attachment', args=[name]),
+            urllib.urlencode({
+                'expires': expires,
+                'signature': sign(name, expires),
+            })))
+
+
+def delete(name):
+    default_storage.delete(name)
+
+
+def sign(name, expires):
+    message = u'%s:%s' % (name, expires)
+
+    return hmac.new(
+        bytes(settings.SECRET_KEY),
+        message.encode('utf-8'),
+        hashlib.sha256).hexdigest()
+
+
+def verify(name, expires, signature):
+    try:
+        expires = int(expires)
+    except (TypeError, ValueError):
+        return False
+
+    if expires < time.time() or not signature:
+        return False
+
+    return constant_time_compare(sign(name, expires), signature)
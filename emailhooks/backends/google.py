@@ -2,6 +2,7 @@ import random
 import string
 
 from ..models import GoogleUser
+from ..routing import save_user_routes
 
 
 class GoogleBackend:
@@ -22,6 +23,7 @@ class GoogleBackend:
             )
 
             user.save()
+            save_user_routes(user)
             return user
 
     def get_user(self, user):
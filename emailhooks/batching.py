@@ -0,0 +1,176 @@
+import hashlib
+import logging
+import time
+
+try:
+    from cStringIO import StringIO
+except ImportError:
+    from StringIO import StringIO
+
+from django.core.cache import cache
+
+from google.appengine.api import taskqueue
+from google.appengine.ext import deferred
+
+from . import delivery, signing
+from .hookcache import get_route
+from .models import Delivery
+from .payload import compress
+
+
+# Hooks with batch_deliveries on get their mail as a JSON array of up to
+# BATCH_MAX payloads, posted once BATCH_MAX emails are waiting or about
+# BATCH_WINDOW seconds after they arrived, with one signature over the
+# whole batch. Each email waits as a Delivery of its own (which is what
+# gets logged), tracked by a task on a pull queue tagged with its hook,
+# so the flusher sees all of them without querying.
+BATCH_QUEUE = 'batches'
+BATCH_MAX = 50
+BATCH_WINDOW = 5
+
+# batches are stored as a Delivery too, so keep them under the 1MB
+# entity limit
+BATCH_MAX_SIZE = 900 * 1000
+
+# seconds the flusher holds on to the tasks of a batch it is building
+LEASE_SECONDS = 60
+
+
+def _counter_key(recipient):
+    return 'batch:%s' % recipient
+
+
+def add(deliveries):
+    queue = taskqueue.Queue(BATCH_QUEUE)
+
+    # the queue takes at most 100 tasks per call
+    tasks = [taskqueue.Task(payload=str(d.pk), method='PULL', tag=d.recipient)
+             for d in deliveries]
+    for i in range(0, len(tasks), 100):
+        queue.add(tasks[i:i + 100])
+
+    for recipient in set(d.recipient for d in deliveries):
+        added = len([d for d in deliveries if d.recipient == recipient])
+
+        cache.add(_counter_key(recipient), 0, BATCH_WINDOW * 10)
+        try:
+            waiting = cache.incr(_counter_key(recipient), added)
+        except ValueError:
+            # evicted in between
+            cache.set(_counter_key(recipient), added, BATCH_WINDOW * 10)
+            waiting = added
+
+        # a full batch doesn't have to wait for the window to end
+        if waiting >= BATCH_MAX:
+            cache.set(_counter_key(recipient), 0, BATCH_WINDOW * 10)
+            deferred.defer(flush, recipient, _queue=delivery.QUEUE_NAME)
+        else:
+            schedule_flush(recipient)
+
+
+def schedule_flush(recipient):
+    # one flush per hook per window
+    name = 'flush-%s-%d' % (
+        hashlib.sha1(recipient).hexdigest(),
+        int(time.time() // BATCH_WINDOW))
+
+    try:
+        deferred.defer(
+            flush, recipient,
+            _queue=delivery.QUEUE_NAME, _countdown=BATCH_WINDOW, _name=name)
+    except (taskqueue.TaskAlreadyExistsError, taskqueue.TombstonedTaskError):
+        pass
+
+
+def flush(recipient):
+    queue = taskqueue.Queue(BATCH_QUEUE)
+    route = get_route(recipient)
+
+    while True:
+        tasks = queue.lease_tasks_by_tag(
+            LEASE_SECONDS, BATCH_MAX, tag=recipient)
+        if not tasks:
+            return
+
+        members = Delivery.objects.in_bulk(
+            [long(task.payload) for task in tasks])
+
+        # the hook was deleted in the meantime
+        if route is None:
+            Delivery.objects.filter(pk__in=members.keys()).delete()
+            queue.delete_tasks(tasks)
+            continue
+
+        batch, leftover = [], []
+        size = 0
+
+        for task in tasks:
+            member = members.get(long(task.payload))
+            if member is None:
+                batch.append(task)
+                continue
+
+            if size and size + len(member.payload) > BATCH_MAX_SIZE:
+                leftover.append(task)
+                continue
+
+            size += len(member.payload)
+            batch.append(task)
+
+        # hand the ones that didn't fit back for the next batch
+        for task in leftover:
+            queue.modify_task_lease(task, 0)
+
+        ids = [long(task.payload) for task in batch]
+        found = [members[pk] for pk in ids if pk in members]
+
+        if found:
+            delivery.enqueue(build(route, found))
+
+        queue.delete_tasks(batch)
+
+        logging.info('Sent a batch of %s to %s', len(found), recipient)
+
+
+# joins the member payloads into an array, compressed and signed the way
+# single payloads are
+def build(route, members):
+    chunks = _array(member.payload for member in members)
+    if route.compress_payload:
+        chunks = compress(chunks)
+
+    signer = signing.for_route(route, int(time.time()))
+    buf = StringIO()
+
+    for chunk in chunks:
+        signer.update(chunk)
+        buf.write(chunk)
+
+    payload = buf.getvalue()
+    buf.close()
+
+    batch = Delivery(
+        user_id=route.user_id,
+        recipient=route.recipient,
+        destination=route.destination,
+        signature=signer.hexdigest(),
+        signed_at=signer.timestamp,
+        content_encoding='gzip' if route.compress_payload else '',
+        payload=payload,
+        num_attachments=sum(member.num_attachments for member in members),
+        size=len(payload),
+        batch=[member.pk for member in members])
+
+    batch.save()
+    return batch
+
+
+def _array(payloads):
+    yield '['
+
+    for i, payload in enumerate(payloads):
+        if i:
+            yield ', '
+        yield payload
+
+    yield ']'
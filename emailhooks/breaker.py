@@ -0,0 +1,68 @@
+import hashlib
+
+from django.core.cache import cache
+
+
+# consecutive failures before the breaker for a destination opens
+FAILURE_THRESHOLD = 5
+
+# how long an open breaker sheds deliveries before letting a probe through
+COOLDOWN = 5 * 60
+
+# failures older than this are forgotten
+FAILURE_WINDOW = 60 * 60
+
+
+def _key(kind, destination):
+    # memcache keys have a length limit and can't contain spaces
+    return 'breaker:%s:%s' % (kind, hashlib.sha1(destination).hexdigest())
+
+
+def is_open(destination):
+    return cache.get(_key('open', destination)) is not None
+
+
+def is_tripped(destination):
+    failures = cache.get(_key('failures', destination)) or 0
+    return failures >= FAILURE_THRESHOLD
+
+
+def allow(destination):
+    if is_open(destination):
+        return False
+
+    if not is_tripped(destination):
+        return True
+
+    # half-open: the cooldown is over, let exactly one probe through
+    return cache.add(_key('probe', destination), 1, COOLDOWN)
+
+
+def record_success(destination):
+    cache.delete_many([
+        _key('failures', destination),
+        _key('open', destination),
+        _key('probe', destination),
+    ])
+
+
+# returns True if this failure opened the breaker
+def record_failure(destination):
+    key = _key('failures', destination)
+
+    if cache.add(key, 1, FAILURE_WINDOW):
+        failures = 1
+    else:
+        try:
+            failures = cache.incr(key)
+        except ValueError:
+            # expired between add() and incr()
+            cache.set(key, 1, FAILURE_WINDOW)
+            failures = 1
+
+    if failures < FAILURE_THRESHOLD:
+        return False
+
+    cache.set(_key('open', destination), 1, COOLDOWN)
+    cache.delete(_key('probe', destination))
+    return True
@@ -0,0 +1,95 @@
+import datetime
+import hashlib
+
+from django.core.cache import cache
+
+from google.appengine.ext import deferred
+
+from djangoappengine.db.utils import commit_locked, get_cursor, set_cursor
+
+from .models import SeenEmail
+
+
+# Mail providers resend and forwarding setups deliver the same message
+# more than once. A message counts as a duplicate when one with the same
+# Message-ID, recipients and content was seen within TTL. The headers
+# are left out of the digest as they differ between copies (Received).
+#
+# The cache answers most lookups, the datastore covers evictions.
+TTL = 24 * 60 * 60
+CACHE_TTL = 60 * 60
+
+# SeenEmail rows deleted per expire task
+BATCH_SIZE = 500
+
+
+def _cache_key(key):
+    return 'seen:%s' % key
+
+
+# returns None for mail without a Message-ID, which is never deduplicated
+def digest(email, body):
+    if not email.message_id:
+        return None
+
+    # the content starts after the first blank line
+    ends = [i for i in (body.find('\r\n\r\n'), body.find('\n\n')) if i != -1]
+    start = min(ends) if ends else len(body)
+
+    content = hashlib.sha1(buffer(body, start)).hexdigest()
+
+    key = u'\0'.join(
+        [email.message_id] + sorted(email.recipients) + [content])
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+# marks the message as seen, returns True if it already was
+def seen(key):
+    # add() also fails when memcache does, so it only counts as seen if
+    # the mark can be read back
+    if (not cache.add(_cache_key(key), True, CACHE_TTL) and
+            cache.get(_cache_key(key))):
+        return True
+
+    return _seen_stored(key)
+
+
+@commit_locked
+def _seen_stored(key):
+    now = datetime.datetime.now()
+
+    try:
+        entry = SeenEmail.objects.get(pk=key)
+        if entry.created > now - datetime.timedelta(seconds=TTL):
+            return True
+    except SeenEmail.DoesNotExist:
+        pass
+
+    SeenEmail(key=key, created=now).save()
+    return False
+
+
+# for when a message could not be handled, so a resend goes through
+def forget(key):
+    cache.delete(_cache_key(key))
+    SeenEmail.objects.filter(pk=key).delete()
+
+
+# removes expired SeenEmail rows, deferred daily with the log retention
+def expire(cursor=None):
+    horizon = datetime.datetime.now() - datetime.timedelta(seconds=TTL)
+
+    expired = SeenEmail.objects.filter(created__lt=horizon)
+    if cursor:
+        expired = set_cursor(expired, start=cursor)
+
+    batch = expired.values_list('pk', flat=True)[:BATCH_SIZE]
+    keys = list(batch)
+
+    if not keys:
+        return
+
+    SeenEmail.objects.filter(pk__in=keys).delete()
+
+    if len(keys) == BATCH_SIZE:
+        deferred.defer(expire, get_cursor(batch))
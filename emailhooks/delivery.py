@@ -0,0 +1,311 @@
+import hashlib
+import logging
+import random
+import time
+
+from django.utils.text import Truncator
+
+from google.appengine.api import taskqueue
+from google.appengine.ext import deferred
+
+from djangoappengine.db.utils import commit_locked
+
+from . import breaker, signing, stats
+from .hookcache import get_route
+from .logwriter import writer as logs
+from .models import Delivery, LogEntry
+from .transport import TransportError, get_transport
+
+
+# deliveries run on their own queue (see queue.yaml) so a slow or
+# unreachable endpoint never holds up the inbound mail request
+QUEUE_NAME = 'delivery'
+
+# tasks can run for much longer than the mail request, so give slow
+# endpoints a fair chance to answer
+FETCH_DEADLINE = 30
+
+# retry schedule: capped exponential backoff with full jitter
+MAX_ATTEMPTS = 8
+BACKOFF_BASE = 10
+BACKOFF_CAP = 60 * 60
+
+
+def backoff(attempts):
+    return random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempts))
+
+
+def enqueue(delivery, countdown=0, transactional=False):
+    deferred.defer(
+        deliver, delivery.pk, _queue=QUEUE_NAME, _countdown=countdown,
+        _transactional=transactional)
+
+
+# deliveries for the same email go out together from one task
+def enqueue_many(deliveries):
+    if len(deliveries) == 1:
+        return enqueue(deliveries[0])
+
+    deferred.defer(
+        deliver_many, [delivery.pk for delivery in deliveries],
+        _queue=QUEUE_NAME)
+
+
+def deliver(delivery_id):
+    deliver_many([delivery_id])
+
+
+def deliver_many(delivery_ids):
+    try:
+        _deliver_many(delivery_ids)
+    finally:
+        # the deliveries are gone, so their log entries must be written
+        # before the task ends
+        logs.flush(wait=True)
+
+
+def _deliver_many(delivery_ids):
+    deliveries = Delivery.objects.filter(pk__in=delivery_ids)
+    started = []
+
+    for delivery in deliveries:
+        # parked deliveries are only sent again by the drain task
+        if delivery.parked:
+            continue
+
+        # don't hammer a destination that is known to be down
+        if not breaker.allow(delivery.destination):
+            park(delivery)
+            continue
+
+        tripped = breaker.is_tripped(delivery.destination)
+        started.append((delivery, tripped, start(delivery)))
+
+    # all the posts are in flight, so this takes as long as the slowest
+    for delivery, tripped, call in started:
+
+        # a successful probe closes the breaker, so let the backlog go
+        if finish(delivery, *call) and tripped:
+            release(delivery.destination)
+
+
+def attempt(delivery):
+    return finish(delivery, *start(delivery))
+
+
+def start(delivery):
+    started = time.time()
+
+    # try to post to destination
+    try:
+        signature, timestamp = sign(delivery)
+
+        headers = {
+            'Content-Type': 'application/json',
+            'X-Hook-Signature': signature,
+        }
+
+        if timestamp is not None:
+            headers['X-Hook-Timestamp'] = str(timestamp)
+
+        if delivery.content_encoding:
+            headers['Content-Encoding'] = delivery.content_encoding
+
+        call = get_transport().start(
+            delivery.destination, delivery.payload, headers, FETCH_DEADLINE)
+    except TransportError as err:
+        logging.exception('transport error: %s', err)
+        call = None
+
+    return call, started
+
+
+# Timestamped signatures are made again for every attempt, so retried
+# and parked deliveries don't go out with the time the email came in.
+def sign(delivery):
+    if not delivery.signed_at:
+        return delivery.signature, None
+
+    route = get_route(delivery.recipient)
+    if route is None:
+        return delivery.signature, delivery.signed_at
+
+    signer = signing.for_route(route, int(time.time()))
+    signer.update(delivery.payload)
+    return signer.hexdigest(), signer.timestamp
+
+
+def finish(delivery, call, started):
+    # keep log of the outgoing request
+    entry = LogEntry(
+        user_id=delivery.user_id,
+        recipient=delivery.recipient,
+        destination=delivery.destination,
+        num_attachments=delivery.num_attachments,
+        size=delivery.size)
+
+    delivered = False
+
+    try:
+        if call is not None:
+            result = get_transport().result(call)
+
+            entry.status_code = result.status_code
+            entry.response = Truncator(result.content).chars(100)
+
+            if (result.content == ''):
+                entry.response = 'N/A'
+
+            # server errors and throttling are worth another try
+            delivered = (result.status_code < 500 and
+                         result.status_code != 429)
+
+            logging.info(
+                'Returned %s : %s', entry.status_code, entry.response)
+    except TransportError as err:
+        logging.exception('transport error: %s', err)
+
+    delivery.attempts += 1
+    latency = time.time() - started
+
+    settle(delivery, entry, delivered)
+
+    # counted once the outcome is stored, so a failing counter can't get
+    # the delivery retried (and posted again)
+    stats.record(delivery, entry.status_code, latency, delivered,
+                 count=len(delivery.batch or ()) or 1)
+
+    return delivered
+
+
+# logs and removes the delivery, or schedules the next attempt
+def settle(delivery, entry, delivered):
+    if delivered:
+        breaker.record_success(delivery.destination)
+        done(delivery, entry)
+        return
+
+    opened = breaker.record_failure(delivery.destination)
+
+    if delivery.attempts >= MAX_ATTEMPTS:
+        logging.error(
+            'Giving up on delivery %s after %s attempts',
+            delivery.pk, delivery.attempts)
+
+        done(delivery, entry)
+
+        # this may have been the drain probe, keep the backlog moving
+        if opened:
+            schedule_drain(delivery.destination)
+    elif opened:
+        park(delivery)
+    else:
+        countdown = backoff(delivery.attempts)
+
+        logging.info(
+            'Retrying delivery %s in %.0fs (attempt %s)',
+            delivery.pk, countdown, delivery.attempts)
+
+        delivery.save()
+        enqueue(delivery, countdown=countdown)
+
+
+# Logs the outcome and removes the delivery. Batches (see batching.py)
+# are logged as the emails they were made of.
+def done(delivery, entry):
+    if not delivery.batch:
+        logs.add(entry)
+        delivery.delete()
+        return
+
+    members = Delivery.objects.filter(pk__in=delivery.batch)
+
+    for member in members:
+        logs.add(LogEntry(
+            user_id=member.user_id,
+            recipient=member.recipient,
+            destination=member.destination,
+            num_attachments=member.num_attachments,
+            size=member.size,
+            status_code=entry.status_code,
+            response=entry.response))
+
+    members.delete()
+    delivery.delete()
+
+
+def park(delivery):
+    logging.info(
+        'Breaker open for %s, parking delivery %s',
+        delivery.destination, delivery.pk)
+
+    delivery.parked = True
+    delivery.save()
+    schedule_drain(delivery.destination)
+
+
+def schedule_drain(destination):
+    # one drain task per destination per cooldown period
+    name = 'drain-%s-%d' % (
+        hashlib.sha1(destination).hexdigest(),
+        int(time.time() // breaker.COOLDOWN))
+
+    try:
+        deferred.defer(
+            drain, destination,
+            _queue=QUEUE_NAME, _countdown=breaker.COOLDOWN, _name=name)
+    except (taskqueue.TaskAlreadyExistsError, taskqueue.TombstonedTaskError):
+        pass
+
+
+def drain(destination):
+    try:
+        _drain(destination)
+    finally:
+        logs.flush(wait=True)
+
+
+def _drain(destination):
+    parked = Delivery.objects.filter(destination=destination, parked=True)
+
+    probe = list(parked[:1])
+    if not probe:
+        return
+
+    if not breaker.allow(destination):
+        schedule_drain(destination)
+        return
+
+    # the probe closes the breaker and releases the backlog on success,
+    # or opens it again and parks itself on failure
+    delivery = probe[0]
+    delivery.parked = False
+
+    if attempt(delivery):
+        release(destination)
+    else:
+        schedule_drain(destination)
+
+
+def release(destination):
+    parked = Delivery.objects.filter(destination=destination, parked=True)
+
+    for pk in parked.values_list('pk', flat=True):
+        unpark(pk)
+
+
+# the parked query is only eventually consistent, so flip the flag in a
+# transaction to make sure each delivery is only ever released once
+@commit_locked
+def unpark(delivery_id):
+    try:
+        delivery = Delivery.objects.get(pk=delivery_id)
+    except Delivery.DoesNotExist:
+        return
+
+    if not delivery.parked:
+        return
+
+    delivery.parked = False
+    delivery.save()
+    enqueue(delivery, transactional=True)
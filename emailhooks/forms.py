@@ -1,4 +1,5 @@
 from models import EmailHook
+from payload import ALL_FIELDS, split_fields
 
 from django import forms
 
@@ -6,7 +7,19 @@ from django import forms
 class EmailHookForm(forms.ModelForm):
     class Meta:
         model = EmailHook
-        fields = ['recipient', 'destination']
+        fields = [
+            'recipient',
+            'destination',
+            'offload_attachments',
+            'compress_payload',
+            'payload_profile',
+            'payload_fields',
+            'rate_burst',
+            'rate_limit',
+            'batch_deliveries',
+            'signature_algorithm',
+            'timestamp_signature',
+        ]
 
     def clean_recipient(self):
         recipient = self.cleaned_data.get('recipient').lower()
@@ -22,3 +35,17 @@ class EmailHookForm(forms.ModelForm):
             raise forms.ValidationError('Recipient already taken')
         else:
             return recipient
+
+    def clean_payload_fields(self):
+        fields = split_fields(self.cleaned_data.get('payload_fields') or '')
+
+        unknown = [name for name in fields if name not in ALL_FIELDS]
+        if unknown:
+            raise forms.ValidationError(
+                'Unknown fields: %s' % ', '.join(unknown))
+
+        if (self.cleaned_data.get('payload_profile') == 'custom' and
+                not fields):
+            raise forms.ValidationError('Pick at least one field')
+
+        return ', '.join(fields)
@@ -0,0 +1,81 @@
+from django.core.cache import cache
+from django.db.models.signals import post_save, post_delete
+
+from . import routing
+from .lru import LRUCache
+from .models import HookRoute
+
+
+# Read-through cache for the route behind a recipient. Lookups hit a
+# small per-instance LRU first, then the shared django cache, and only
+# then the datastore. Recipients without a hook are cached as well, so
+# spam to unknown addresses stays cheap.
+#
+# The shared cache is invalidated when routes change, the local one
+# can't be reached from other instances so it only keeps entries for a
+# short while.
+LOCAL_SIZE = 1000
+LOCAL_TTL = 30
+SHARED_TTL = 10 * 60
+
+# cached in place of a route for recipients without a hook
+MISSING = 'missing'
+
+
+local = LRUCache(LOCAL_SIZE, LOCAL_TTL)
+
+
+def _key(recipient):
+    return 'route:%s' % recipient
+
+
+# returns the HookRoutes for the recipients that have a hook
+def get_routes(recipients):
+    found = {}
+
+    for recipient in recipients:
+        value = local.get(_key(recipient))
+        if value is not None:
+            found[recipient] = value
+
+    missing = [r for r in recipients if r not in found]
+
+    if missing:
+        shared = cache.get_many([_key(r) for r in missing])
+        for recipient in missing:
+            value = shared.get(_key(recipient))
+            if value is not None:
+                found[recipient] = value
+                local.set(_key(recipient), value)
+
+        missing = [r for r in missing if r not in found]
+
+    if missing:
+        loaded = {}
+        for recipient, route in routing.get_routes(missing).items():
+            loaded[_key(recipient)] = found[recipient] = route or MISSING
+            local.set(_key(recipient), found[recipient])
+
+        cache.set_many(loaded, SHARED_TTL)
+
+    return [found[r] for r in recipients if found.get(r, MISSING) != MISSING]
+
+
+# returns the HookRoute for recipient, or None if there is no hook
+def get_route(recipient):
+    routes = get_routes([recipient])
+    return routes[0] if routes else None
+
+
+def invalidate(recipient):
+    key = _key(recipient)
+    cache.delete(key)
+    local.delete(key)
+
+
+def _route_changed(sender, instance, **kwargs):
+    invalidate(instance.pk)
+
+
+post_save.connect(_route_changed, sender=HookRoute)
+post_delete.connect(_route_changed, sender=HookRoute)
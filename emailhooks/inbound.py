@@ -0,0 +1,209 @@
+import hashlib
+import logging
+import time
+
+try:
+    from cStringIO import StringIO
+except ImportError:
+    from StringIO import StringIO
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.template.defaultfilters import filesizeformat
+
+from google.appengine.ext import deferred
+
+from . import attachments, batching, dedup, ratelimit, signing
+from .delivery import enqueue_many
+from .hookcache import get_routes
+from .logwriter import writer as logs
+from .models import Email, LogEntry, Delivery
+from .payload import ALL_FIELDS, PayloadWriter
+
+
+# mail over its hook's or user's rate limit waits on its own queue (see
+# queue.yaml), so one noisy user can't tie up the mail handler
+HELD_QUEUE = 'held'
+
+# Payloads are stored in the Delivery entity, which has to stay under
+# the datastore's 1MB limit. Offloading hooks get all attachments as
+# links when the inline ones would take up too much of that, anything
+# still bigger isn't delivered.
+MAX_PAYLOAD_SIZE = 900 * 1000
+
+
+# Takes an inbound message the rest of the way once its routes are known.
+# base_url is where attachment download links point to.
+def handle(body, routes, base_url):
+    email = Email(body, headers_only=True)
+
+    # acknowledge resent copies without delivering them again
+    seen_key = dedup.digest(email, body)
+
+    if seen_key and dedup.seen(seen_key):
+        logging.info('Duplicate of %s, not delivering', email.message_id)
+
+        for route in routes:
+            logs.add(LogEntry(
+                user_id=route.user_id,
+                recipient=route.recipient,
+                destination=route.destination,
+                num_attachments=0,
+                size=len(body),
+                status_code='DUP',
+                response='Duplicate, not delivered'))
+
+        logs.flush(wait=True)
+        return
+
+    try:
+        allowed, limited = ratelimit.check(routes)
+
+        if limited:
+            hold(body, limited, base_url)
+
+        if allowed:
+            dispatch(email, allowed, base_url)
+    except Exception:
+        # let the mail service's retry through
+        if seen_key:
+            dedup.forget(seen_key)
+        raise
+
+
+# writes the payloads for the routes and queues their deliveries
+def dispatch(email, routes, base_url):
+    # hooks that offload, compress or want other fields get a different
+    # payload, so each combination is written out separately. Batched
+    # payloads are compressed and signed as a whole later on.
+    variants = {}
+    for route in routes:
+        variant = (route.offload_attachments,
+                   route.compress_payload and not route.batch_deliveries,
+                   tuple(route.fields or ALL_FIELDS))
+        variants.setdefault(variant, []).append(route)
+
+    # only decode the parts some payload is going to use
+    email.read_parts(set(
+        name for _, _, fields in variants for name in fields))
+
+    if any(offload for offload, _, _ in variants):
+        inline = sum(len(chunk) for attachment in email.attachments
+                     for chunk in attachment['payload'])
+
+        if inline > MAX_PAYLOAD_SIZE // 2:
+            attachments.offload(email, base_url, threshold=0)
+        else:
+            attachments.offload(email, base_url)
+
+    deliveries = []
+    batched = []
+    timestamp = int(time.time())
+
+    for i, ((offload, compress, fields), variant) in enumerate(
+            sorted(variants.items())):
+        signers = {}
+        for route in variant:
+            if signing.spec(route) not in signers:
+                signers[signing.spec(route)] = signing.for_route(
+                    route, timestamp)
+
+        # stream the json out, signing it for every user as it goes. The
+        # attachments are only dropped while writing the last payload.
+        writer = PayloadWriter(
+            email, signers.values(),
+            offload=offload,
+            consume=i == len(variants) - 1,
+            compress=compress,
+            fields=fields)
+
+        buf = StringIO()
+        writer.write_to(buf)
+
+        payload = buf.getvalue()
+        buf.close()
+
+        logging.info(
+            '%s attachments, request is about ~%s',
+            len(email.attachments),
+            filesizeformat(writer.size))
+
+        if len(payload) > MAX_PAYLOAD_SIZE:
+            logging.error(
+                'Payload of %s is too large, not delivering to %s',
+                filesizeformat(len(payload)),
+                ', '.join(route.recipient for route in variant))
+
+            for route in variant:
+                logs.add(LogEntry(
+                    user_id=route.user_id,
+                    recipient=route.recipient,
+                    destination=route.destination,
+                    num_attachments=len(email.attachments),
+                    size=len(payload),
+                    status_code='BIG',
+                    response='Payload too large, not delivered'))
+
+            logs.flush(wait=True)
+            continue
+
+        # persist the payloads and hand the POSTs off to the delivery queue
+        for route in variant:
+            signer = signers[signing.spec(route)]
+
+            delivery = Delivery(
+                user_id=route.user_id,
+                recipient=route.recipient,
+                destination=route.destination,
+                signature=signer.hexdigest(),
+                signed_at=signer.timestamp,
+                content_encoding=writer.content_encoding,
+                payload=payload,
+                num_attachments=len(email.attachments),
+                size=writer.size)
+
+            delivery.save()
+
+            if route.batch_deliveries:
+                batched.append(delivery)
+            else:
+                deliveries.append(delivery)
+
+    if deliveries:
+        enqueue_many(deliveries)
+
+    if batched:
+        batching.add(batched)
+
+
+# Keeps the raw message in blob storage until the routes are under their
+# limits again. Held mail was already checked for duplicates.
+def hold(body, routes, base_url, name=None):
+    if name is None:
+        name = default_storage.save(
+            'held-%s.eml' % hashlib.sha1(body).hexdigest(),
+            ContentFile(body))
+
+    countdown = ratelimit.retry_after(routes)
+
+    logging.info(
+        'Over the rate limit, holding %s for %s for %.0fs',
+        name, ', '.join(route.recipient for route in routes), countdown)
+
+    deferred.defer(
+        release, name, [route.recipient for route in routes], base_url,
+        _queue=HELD_QUEUE, _countdown=countdown)
+
+
+def release(name, recipients, base_url):
+    routes = get_routes(recipients)
+    allowed, limited = ratelimit.check(routes)
+
+    if allowed:
+        body = default_storage.open(name).read()
+        dispatch(Email(body, headers_only=True), allowed, base_url)
+
+    if limited:
+        hold(None, limited, base_url, name=name)
+    else:
+        default_storage.delete(name)
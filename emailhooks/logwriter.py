@@ -0,0 +1,98 @@
+import logging
+import threading
+import time
+
+from google.appengine.api import runtime
+
+from djangoappengine.db.utils import bulk_create_async
+
+from .models import LogEntry
+
+
+# LogEntry rows are buffered and written together with one multi-entity
+# put instead of one put per delivery. Whatever adds entries has to
+# flush(wait=True) before its task ends (deliver_many, drain and
+# inbound.handle do), as instances under automatic scaling go away
+# without running the shutdown hook. So entries are batched per task,
+# and the task waits for their put once at its end. The thresholds only
+# start a put in the background earlier, for tasks that add more than
+# MAX_ENTRIES entries or take longer than MAX_AGE seconds.
+MAX_ENTRIES = 50
+MAX_AGE = 10
+
+# set to False to save every entry straight away
+BUFFERED = True
+
+
+class LogWriter(object):
+    def __init__(self, max_entries=MAX_ENTRIES, max_age=MAX_AGE):
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self.entries = []
+        self.oldest = None
+        self.pending = []
+        self.lock = threading.Lock()
+
+    def add(self, entry):
+        if not BUFFERED:
+            return self.write(entry)
+
+        with self.lock:
+            if not self.entries:
+                self.oldest = time.time()
+
+            self.entries.append(entry)
+
+            due = (len(self.entries) >= self.max_entries or
+                   time.time() - self.oldest >= self.max_age)
+
+        if due:
+            self.flush()
+
+    # synchronous fallback
+    def write(self, entry):
+        entry.save()
+
+    def flush(self, wait=False):
+        with self.lock:
+            batch, self.entries = self.entries, []
+            finished, self.pending = self.pending, []
+
+        # surface errors from earlier puts, they are done by now
+        for rpc, entries in finished:
+            self._finish(rpc, entries)
+
+        if not batch:
+            return
+
+        try:
+            rpc = bulk_create_async(batch)
+        except Exception:
+            logging.exception('Could not start log put, saving directly')
+            LogEntry.objects.bulk_create(batch)
+            return
+
+        if wait:
+            self._finish(rpc, batch)
+        else:
+            with self.lock:
+                self.pending.append((rpc, batch))
+
+    def _finish(self, rpc, entries):
+        try:
+            rpc.get_result()
+        except Exception:
+            logging.exception(
+                'Log put failed, saving %s entries directly', len(entries))
+            LogEntry.objects.bulk_create(entries)
+
+
+writer = LogWriter()
+
+
+# only runs on manual and basic scaling instances
+def _shutdown():
+    writer.flush(wait=True)
+
+
+runtime.set_shutdown_hook(_shutdown)
@@ -0,0 +1,39 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+# Small thread safe LRU cache for per-instance state, entries expire
+# after ttl seconds.
+class LRUCache(object):
+    def __init__(self, size, ttl):
+        self.size = size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            try:
+                value, expires = self.entries.pop(key)
+            except KeyError:
+                return None
+
+            if expires < time.time():
+                return None
+
+            # re-insert to mark as most recently used
+            self.entries[key] = (value, expires)
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = (value, time.time() + self.ttl)
+
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
@@ -0,0 +1,32 @@
+from django.core.management.base import NoArgsCommand
+
+from ...models import EmailHook, GoogleUser
+from ...routing import save_route
+
+
+class Command(NoArgsCommand):
+    help = "Builds the routing records for existing hooks " \
+           "(e.g. manage.py remote backfill_routes)."
+
+    def handle_noargs(self, **options):
+        users = {}
+        count = 0
+
+        for hook in EmailHook.objects.all():
+            if hook.user_id not in users:
+                try:
+                    users[hook.user_id] = GoogleUser.objects.get(
+                        user_id=hook.user_id)
+                except GoogleUser.DoesNotExist:
+                    users[hook.user_id] = None
+
+            user = users[hook.user_id]
+            if user is None:
+                self.stderr.write('No user for hook %s, skipping' %
+                                  hook.recipient)
+                continue
+
+            save_route(hook, user)
+            count += 1
+
+        self.stdout.write('Saved %s routes' % count)
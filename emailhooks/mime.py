@@ -0,0 +1,299 @@
+import base64
+import binascii
+import re
+from email.header import decode_header
+from email.message import Message
+
+
+# Single pass MIME parser. parse() walks the raw message line by line
+# and yields events as it goes instead of building a message tree:
+#
+#   (HEADER, name, value)           top level headers, in order
+#   (BODY, content_type, text)      text/plain and text/html bodies
+#   (ATTACHMENT, filename, type)    start of an attachment
+#   (CHUNK, data)                   base64 data for the current attachment
+#
+# Only the body types in `bodies` are decoded, and attachment data is
+# only read out when `attachments` is set; everything else is skipped
+# over without being decoded. Attachments still get their ATTACHMENT
+# event either way, so they can be counted.
+HEADER = 'header'
+BODY = 'body'
+ATTACHMENT = 'attachment'
+CHUNK = 'chunk'
+
+# attachment data is handed out in chunks of about this size
+CHUNK_SIZE = 64 * 1024
+
+BODY_TYPES = ('text/plain', 'text/html')
+
+# a line of base64 data that can be passed through as it is
+BASE64_LINE = re.compile(r'[A-Za-z0-9+/]*\Z')
+NOT_BASE64 = re.compile(r'[^A-Za-z0-9+/]')
+
+
+def parse(source, bodies=BODY_TYPES, attachments=True):
+    return MimeParser(source, bodies, attachments)
+
+
+def iter_lines(source):
+    if not isinstance(source, basestring):
+        return iter(source)
+
+    return _split_lines(source)
+
+
+def _split_lines(text):
+    # like text.splitlines(True), without copying the whole message
+    start = 0
+    end = len(text)
+
+    while start < end:
+        stop = text.find('\n', start)
+        if stop == -1:
+            stop = end
+        else:
+            stop += 1
+
+        yield text[start:stop]
+        start = stop
+
+
+def decode_header_value(value):
+    try:
+        parts = decode_header(value)
+    except Exception:
+        return value
+
+    decoded = []
+    for text, charset in parts:
+        try:
+            decoded.append(text.decode(charset or 'ascii'))
+        except (LookupError, UnicodeError):
+            decoded.append(text.decode('utf-8', 'replace'))
+
+    return u' '.join(decoded)
+
+
+def decode_text(data, encoding, charset):
+    if encoding == 'base64':
+        try:
+            data = base64.decodestring(data)
+        except binascii.Error:
+            pass
+    elif encoding == 'quoted-printable':
+        data = binascii.a2b_qp(data)
+
+    try:
+        return data.decode(charset or 'utf-8', 'replace')
+    except LookupError:
+        return data.decode('utf-8', 'replace')
+
+
+class MimeParser(object):
+    def __init__(self, source, bodies=BODY_TYPES, attachments=True):
+        self.lines = iter_lines(source)
+        self.boundaries = []
+        self.bodies = bodies
+        self.attachments = attachments
+        self.top_headers = None
+
+        # (boundary, closing) for the delimiter that ended the last body
+        self.delimiter = None
+
+    def __iter__(self):
+        for name, value in self.headers():
+            yield (HEADER, name, value)
+
+        for event in self.parts():
+            yield event
+
+    # The top level headers, as (name, value) pairs. Only reads up to the
+    # end of the header block, so a caller can look at the headers and
+    # decide what it wants from the rest before calling parts().
+    def headers(self):
+        if self.top_headers is None:
+            self.top_headers = self._read_headers()
+
+        return self.top_headers
+
+    def parts(self):
+        return self._part(self.headers())
+
+    def _read_headers(self):
+        headers = []
+
+        for line in self.lines:
+            if line in ('\r\n', '\n'):
+                break
+
+            # folded header continues the previous one
+            if line[:1] in (' ', '\t') and headers:
+                name, value = headers[-1]
+                headers[-1] = (name, value + ' ' + line.strip())
+                continue
+
+            name, sep, value = line.partition(':')
+            if sep:
+                headers.append((name.strip(), value.strip()))
+
+        return headers
+
+    def _is_delimiter(self, line):
+        if line[:2] != '--' or not self.boundaries:
+            return False
+
+        marker = line[2:].rstrip()
+
+        for boundary in reversed(self.boundaries):
+            if marker == boundary:
+                self.delimiter = (boundary, False)
+                return True
+            if marker == boundary + '--':
+                self.delimiter = (boundary, True)
+                return True
+
+        return False
+
+    def _body_lines(self):
+        self.delimiter = None
+        previous = None
+
+        for line in self.lines:
+            if self._is_delimiter(line):
+                # the line break before a delimiter belongs to it
+                if previous is not None:
+                    yield previous.rstrip('\r\n')
+                return
+
+            if previous is not None:
+                yield previous
+            previous = line
+
+        if previous is not None:
+            yield previous
+
+    def _skip_body(self):
+        for _ in self._body_lines():
+            pass
+
+    def _part(self, headers):
+        info = Message()
+        for name, value in headers:
+            info[name] = value
+
+        content_type = info.get_content_type()
+
+        if content_type.startswith('multipart/'):
+            boundary = info.get_boundary()
+
+            if not boundary:
+                self._skip_body()
+                return
+
+            self.boundaries.append(boundary)
+            self._skip_body()  # preamble
+
+            while self.delimiter == (boundary, False):
+                for event in self._part(self._read_headers()):
+                    yield event
+
+            self.boundaries.pop()
+
+            if self.delimiter == (boundary, True):
+                self._skip_body()  # epilogue
+            return
+
+        encoding = info.get('content-transfer-encoding', '').strip().lower()
+        disposition = info.get('content-disposition', '')
+        disposition = disposition.split(';')[0].strip().lower()
+        filename = info.get_filename()
+
+        if filename or disposition == 'attachment':
+            if filename:
+                filename = decode_header_value(filename)
+
+            yield (ATTACHMENT, filename, content_type)
+
+            if not self.attachments:
+                self._skip_body()
+                return
+
+            for chunk in self._attachment_chunks(encoding):
+                yield (CHUNK, chunk)
+        elif content_type in self.bodies:
+            data = ''.join(self._body_lines())
+            charset = info.get_content_charset()
+            yield (BODY, content_type, decode_text(data, encoding, charset))
+        else:
+            self._skip_body()
+
+    def _attachment_chunks(self, encoding):
+        if encoding == 'base64':
+            chunks = self._passthrough_base64()
+        else:
+            chunks = self._encode_base64(encoding)
+
+        buffered = []
+        size = 0
+
+        for chunk in chunks:
+            buffered.append(chunk)
+            size += len(chunk)
+
+            if size >= CHUNK_SIZE:
+                yield ''.join(buffered)
+                buffered = []
+                size = 0
+
+        if buffered:
+            yield ''.join(buffered)
+
+    def _passthrough_base64(self):
+        # Already base64, hand the lines out as they are. The data is
+        # written into the payload JSON unescaped (see payload.py), so a
+        # line with anything else in it is cleaned up the way a decoder
+        # reads it: padding ends the data and other characters are
+        # skipped. Data is handed out in groups of 4 characters so the
+        # cleaned up lines still join up, and padded only at the end.
+        remainder = ''
+        padded = False
+
+        for line in self._body_lines():
+            line = line.strip()
+            if padded or not line:
+                continue
+
+            if not BASE64_LINE.match(line):
+                line, padding, _ = line.partition('=')
+                line = NOT_BASE64.sub('', line)
+                padded = bool(padding)
+
+            data = remainder + line
+            cut = len(data) - len(data) % 4
+            remainder = data[cut:]
+
+            if cut:
+                yield data[:cut]
+
+        # a single character left over doesn't make up a byte
+        if len(remainder) > 1:
+            yield remainder + '=' * (4 - len(remainder))
+
+    def _encode_base64(self, encoding):
+        # encode in multiples of 3 bytes so the chunks join up cleanly
+        remainder = ''
+
+        for line in self._body_lines():
+            if encoding == 'quoted-printable':
+                line = binascii.a2b_qp(line)
+
+            data = remainder + line
+            cut = len(data) - len(data) % 3
+            remainder = data[cut:]
+
+            if cut:
+                yield base64.b64encode(data[:cut])
+
+        if remainder:
+            yield base64.b64encode(remainder)
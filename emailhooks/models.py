@@ -1,10 +1,25 @@
 import re
-import json
 from email.utils import getaddresses, parseaddr
 
+from django.core.validators import MinValueValidator
 from django.db import models
+from django.utils import timezone
 
-from google.appengine.api import mail, urlfetch
+from djangotoolbox.fields import BlobField, DictField, ListField
+
+from . import mime
+from .payload import ALL_FIELDS, PROFILES, encode
+from .ratelimit import HOOK_BURST, HOOK_RATE
+from .signing import ALGORITHMS
+
+
+FORWARDED_FOR = re.compile('for <?(\S+)@emailhooks\.xyz', re.IGNORECASE)
+
+# payload field each body type ends up in
+BODY_FIELDS = (
+    ('text/html', 'html_body'),
+    ('text/plain', 'plain_body'),
+)
 
 
 class GoogleUser(models.Model):
@@ -12,6 +27,7 @@ class GoogleUser(models.Model):
     email = models.EmailField()
     key = models.CharField()
     last_login = models.DateTimeField(auto_now=True, null=True)
+    log_retention_days = models.IntegerField(default=30)
 
     def is_authenticated(self):
         return True
@@ -21,6 +37,47 @@ class EmailHook(models.Model):
     user_id = models.SlugField(max_length=100)
     recipient = models.SlugField(max_length=100, unique=True)
     destination = models.URLField()
+    offload_attachments = models.BooleanField(default=False)
+    compress_payload = models.BooleanField(default=False)
+    payload_profile = models.CharField(
+        max_length=20, choices=PROFILES, default='full')
+
+    # comma separated, for the custom profile
+    payload_fields = models.CharField(max_length=200, blank=True)
+
+    # token bucket for inbound mail: burst size and messages per minute
+    rate_burst = models.IntegerField(
+        default=HOOK_BURST, validators=[MinValueValidator(1)])
+    rate_limit = models.IntegerField(
+        default=HOOK_RATE, validators=[MinValueValidator(1)])
+
+    # post several emails at once, see batching.py
+    batch_deliveries = models.BooleanField(default=False)
+
+    signature_algorithm = models.CharField(
+        max_length=10, choices=ALGORITHMS, default='sha1')
+    timestamp_signature = models.BooleanField(default=False)
+
+
+# Everything the mail path needs to route a recipient, denormalized from
+# EmailHook and GoogleUser and keyed by recipient so it can be fetched
+# with a single get. Kept up to date by routing.py.
+class HookRoute(models.Model):
+    recipient = models.SlugField(max_length=100, primary_key=True)
+    user_id = models.CharField()
+    destination = models.URLField()
+    key = models.CharField()
+    offload_attachments = models.BooleanField(default=False)
+    compress_payload = models.BooleanField(default=False)
+
+    # payload fields from the hook's profile, empty means all of them
+    fields = ListField(models.CharField())
+
+    rate_burst = models.IntegerField(default=HOOK_BURST)
+    rate_limit = models.IntegerField(default=HOOK_RATE)
+    batch_deliveries = models.BooleanField(default=False)
+    signature_algorithm = models.CharField(default='sha1')
+    timestamp_signature = models.BooleanField(default=False)
 
 
 class LogEntry(models.Model):
@@ -31,76 +88,184 @@ class LogEntry(models.Model):
     size = models.CharField()
     response = models.CharField(default='N/A')
     status_code = models.CharField(default='ERR')
-    created = models.DateTimeField(auto_now=True)
+
+    # set when the entry is built, not when the (buffered) row is saved
+    created = models.DateTimeField(default=timezone.now)
 
     class Meta:
         ordering = ['-created']
 
 
-class Email():
-    def __init__(self, body):
-        # make email obj from body
-        message = mail.InboundEmailMessage(body)
+# Daily roll-up of LogEntry rows removed by the retention job, keyed by
+# user, hook and day (see retention.py).
+class LogSummary(models.Model):
+    key = models.CharField(primary_key=True)
+    user_id = models.CharField()
+    recipient = models.CharField()
+    destination = models.URLField()
+    day = models.DateField()
+    count = models.IntegerField(default=0)
+    size = models.IntegerField(default=0)
+    statuses = DictField(models.IntegerField())
+
+    # the last entry counted, entries are counted in (created, pk) order
+    last_created = models.DateTimeField(null=True)
+    last_pk = models.IntegerField(null=True)
 
-        # list of emails: ['blah@example.com', ...]
-        self.to = [a[1] for a in getaddresses([message.to])]
-        self.cc = [a[1] for a in getaddresses([getattr(message, 'cc', '')])]
 
-        self.recipient = None
+# One shard of a hook's delivery counters for an hour (see stats.py).
+class HookStatShard(models.Model):
+    key = models.CharField(primary_key=True)
+    user_id = models.CharField()
+    recipient = models.CharField()
+    hour = models.DateTimeField()
+    delivered = models.IntegerField(default=0)
+    size = models.IntegerField(default=0)
+    attachments = models.IntegerField(default=0)
+    statuses = DictField(models.IntegerField())
+    latencies = ListField(models.IntegerField())
 
-        # check hook recipient in message.to list first
-        for addr in self.to:
-            if (addr.split('@')[1] == 'emailhooks.xyz'):
-                self.recipient = addr.split('@')[0]
-                break
 
-        # if not in message.to, parse hook recipient from forwarding
-        # details following the patterns:
-        # "for <_____ @emailhooks.xyz>" or "for _____ @emailhooks.xyz"
-        if (self.recipient is None):
-            match = re.search('for <?(\S+)@emailhooks\.xyz', body, re.IGNORECASE)
-            self.recipient = match.group(1).lower() if match else None
+class Delivery(models.Model):
+    user_id = models.CharField()
+    recipient = models.CharField()
+    destination = models.URLField()
+    signature = models.CharField()
+    signed_at = models.IntegerField(null=True)
+    content_encoding = models.CharField(blank=True, default='')
+    payload = BlobField()
+    num_attachments = models.IntegerField()
+    size = models.IntegerField()
+    attempts = models.IntegerField(default=0)
+    parked = models.BooleanField(default=False)
+    created = models.DateTimeField(auto_now_add=True)
 
-        self.sender = parseaddr(message.sender)[1]
-        self.subject = getattr(message, 'subject', '')
-        self.date = message.date
+    # for a batch, the deliveries of the emails in it
+    batch = ListField(models.IntegerField())
 
-        self.html_body = ''
-        for _, body in message.bodies('text/html'):
-            self.html_body = body.decode()
 
+# digests of recently handled mail, see dedup.py
+class SeenEmail(models.Model):
+    key = models.CharField(primary_key=True)
+    created = models.DateTimeField()
+
+
+# Every hook a message is addressed to, in to and then cc, from its top
+# level headers. Falls back to the forwarding details in the Received
+# headers when the message isn't addressed to a hook.
+def find_recipients(headers):
+    addresses = {'to': [], 'cc': []}
+
+    # forwarding details following the patterns:
+    # "for <_____ @emailhooks.xyz>" or "for _____ @emailhooks.xyz"
+    forwarded_for = None
+
+    for name, value in headers:
+        name = name.lower()
+
+        if name in addresses:
+            addresses[name] += [a[1] for a in getaddresses([value])]
+
+        if forwarded_for is None:
+            match = FORWARDED_FOR.search(value)
+            if match:
+                forwarded_for = match.group(1).lower()
+
+    recipients = []
+
+    # to comes first, wherever the headers are in the message
+    for addr in addresses['to'] + addresses['cc']:
+        local, _, domain = addr.partition('@')
+        if (domain.lower() == 'emailhooks.xyz' and
+                local not in recipients):
+            recipients.append(local)
+
+    if (not recipients and forwarded_for):
+        recipients.append(forwarded_for)
+
+    return recipients
+
+
+# Reads only the header block, so mail for recipients without a hook can
+# be turned away before anything else in it is looked at.
+def peek_recipients(body):
+    return find_recipients(mime.parse(body).headers())
+
+
+class Email():
+    # With headers_only, only the header block is read; call read_parts()
+    # once it's clear what the payloads need.
+    def __init__(self, body, fields=ALL_FIELDS, headers_only=False):
+        self.to = []
+        self.cc = []
+        self.sender = ''
+        self.subject = ''
+        self.date = None
+        self.message_id = ''
+        self.html_body = ''
         self.plain_body = ''
-        for _, plain in message.bodies('text/plain'):
-            self.plain_body = plain.decode()
-
-        # Attachments are a list of tuples: (filename, EncodedPayload)
-        # EncodedPayloads are likely to be base64
-        #
-        # EncodedPayload:
-        # https://cloud.google.com/appengine/docs/python/refdocs/google.appengine.api.mail#google.appengine.api.mail.EncodedPayload
-        #
+
+        # Attachments are a list of dicts: {'filename', 'payload'}, where
+        # the payload is a list of base64 chunks. Attachments that arrive
+        # base64 encoded are passed through without decoding them.
         self.attachments = []
 
-        for attachment in getattr(message, 'attachments', []):
-            encoding = attachment[1].encoding
-            payload = attachment[1].payload
-
-            if (not encoding or encoding.lower() != 'base64'):
-                payload = attachment[1].decode().encode('base64')
-
-            self.attachments.append({
-                'filename': attachment[0],
-                'payload': payload
-            })
-
-    def payload(self):
-        return json.dumps({
-            'sender': self.sender,
-            'to': self.to,
-            'cc': self.cc,
-            'date': self.date,
-            'subject': self.subject,
-            'html_body': self.html_body,
-            'plain_body': self.plain_body,
-            'attachments': self.attachments
-        })
+        # single pass over the message, see mime.py
+        self._parser = mime.parse(body)
+        headers = self._parser.headers()
+
+        for name, value in headers:
+            name = name.lower()
+
+            # list of emails: ['blah@example.com', ...]
+            if name == 'to':
+                self.to += [a[1] for a in getaddresses([value])]
+            elif name == 'cc':
+                self.cc += [a[1] for a in getaddresses([value])]
+            elif name == 'from':
+                self.sender = parseaddr(value)[1]
+            elif name == 'subject':
+                self.subject = mime.decode_header_value(value)
+            elif name == 'date':
+                self.date = value
+            elif name == 'message-id':
+                self.message_id = value.strip()
+
+        self.recipients = find_recipients(headers)
+        self.recipient = self.recipients[0] if self.recipients else None
+
+        if not headers_only:
+            self.read_parts(fields)
+
+    # Reads the rest of the message. Bodies and attachments that none of
+    # the given payload fields need are skipped without being decoded.
+    def read_parts(self, fields=ALL_FIELDS):
+        parser = self._parser
+        parser.bodies = [content_type for content_type, name in BODY_FIELDS
+                         if name in fields]
+        parser.attachments = 'attachments' in fields
+
+        chunks = None
+
+        for event in parser.parts():
+            kind = event[0]
+
+            if kind == mime.CHUNK:
+                chunks.append(event[1])
+
+            elif kind == mime.ATTACHMENT:
+                chunks = []
+                self.attachments.append({
+                    'filename': event[1],
+                    'payload': chunks
+                })
+
+            elif kind == mime.BODY:
+                if event[1] == 'text/html':
+                    self.html_body = event[2]
+                else:
+                    self.plain_body = event[2]
+
+    # writing the payload consumes the attachment chunks, see payload.py
+    def payload(self, fields=ALL_FIELDS):
+        return ''.join(encode(self, fields=fields))
@@ -0,0 +1,154 @@
+import json
+import zlib
+
+
+# scalar fields of the payload, in the order they are written
+FIELDS = (
+    'sender',
+    'to',
+    'cc',
+    'date',
+    'subject',
+    'html_body',
+    'plain_body',
+)
+
+# everything a payload can hold
+ALL_FIELDS = FIELDS + ('attachments',)
+
+# Payload profiles a hook can pick from. Fields left out of a hook's
+# profile are not even decoded when only such hooks get the email.
+PROFILES = (
+    ('full', 'Everything'),
+    ('no_attachments', 'Everything but attachments'),
+    ('headers', 'Headers only'),
+    ('custom', 'Pick fields'),
+)
+
+PROFILE_FIELDS = {
+    'full': ALL_FIELDS,
+    'no_attachments': FIELDS,
+    'headers': ('sender', 'to', 'cc', 'date', 'subject'),
+}
+
+# compression level for hooks that take gzipped payloads
+COMPRESS_LEVEL = 6
+
+
+# "sender, subject" -> ['sender', 'subject']
+def split_fields(value):
+    return [name for name in value.replace(',', ' ').split() if name]
+
+
+# the payload fields of a profile, in the order they are written
+def profile_fields(profile, custom=()):
+    if profile == 'custom':
+        return tuple(name for name in ALL_FIELDS if name in custom)
+
+    return PROFILE_FIELDS.get(profile, ALL_FIELDS)
+
+
+# Writes the email out as JSON a piece at a time. Attachment payloads
+# are already base64 (which never needs escaping in JSON, and the parser
+# makes sure they hold nothing else), so their chunks are written as
+# they are and dropped from the email once they have been written, so
+# an attachment only ever exists once in memory.
+# Pass consume=False to keep them around for another payload.
+#
+# With offload, attachments that were moved to blob storage (see
+# attachments.py) are written as links instead.
+def encode(email, offload=False, consume=True, fields=ALL_FIELDS):
+    yield '{'
+
+    scalars = [name for name in FIELDS if name in fields]
+
+    for i, name in enumerate(scalars):
+        if i:
+            yield ', '
+
+        yield '%s: %s' % (json.dumps(name), json.dumps(getattr(email, name)))
+
+    if 'attachments' not in fields:
+        yield '}'
+        return
+
+    if scalars:
+        yield ', '
+
+    yield '"attachments": ['
+
+    for i, attachment in enumerate(email.attachments):
+        if i:
+            yield ', '
+
+        if offload and 'url' in attachment:
+            yield json.dumps({
+                'filename': attachment['filename'],
+                'size': attachment['size'],
+                'url': attachment['url'],
+            })
+            continue
+
+        yield '{"filename": %s, "payload": "' % json.dumps(
+            attachment['filename'])
+
+        chunks = attachment['payload']
+        if consume:
+            while chunks:
+                yield chunks.pop(0)
+        else:
+            for chunk in chunks:
+                yield chunk
+
+        yield '"}'
+
+    yield ']}'
+
+
+# Gzips a stream of chunks as it goes, so the uncompressed payload is
+# never held in memory on top of the compressed one.
+def compress(chunks, level=COMPRESS_LEVEL):
+    # 16 + MAX_WBITS makes zlib write a gzip header and trailer
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+
+    yield compressor.flush()
+
+
+# Feeds every signer it is given (see signing.py) in the same pass, so
+# one payload can go out to hooks owned by different users. Compressed
+# payloads are signed as they are sent, i.e. over the gzipped bytes.
+class PayloadWriter(object):
+    def __init__(self, email, signers, offload=False, consume=True,
+                 compress=False, fields=ALL_FIELDS):
+        self.email = email
+        self.signers = list(signers)
+        self.offload = offload
+        self.consume = consume
+        self.fields = fields
+        self.compress = compress
+        self.content_encoding = 'gzip' if compress else ''
+        self.size = 0
+
+    # can be used directly as a chunked request body, the signatures are
+    # complete once the generator is exhausted
+    def chunks(self):
+        chunks = encode(
+            self.email, self.offload, self.consume, self.fields)
+        if self.compress:
+            chunks = compress(chunks)
+
+        for chunk in chunks:
+            for signer in self.signers:
+                signer.update(chunk)
+
+            self.size += len(chunk)
+            yield chunk
+
+    def write_to(self, out):
+        for chunk in self.chunks():
+            out.write(chunk)
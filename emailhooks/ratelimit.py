@@ -0,0 +1,95 @@
+import random
+import time
+
+from django.core.cache import cache
+
+
+# Token buckets for the mail path, one per hook and one per user, kept
+# in the shared cache. A bucket holding `burst` tokens that refills at
+# `rate` tokens a minute lets at most `burst` messages through in any
+# burst / rate minutes, which is what gets checked: messages are counted
+# in SLOTS time slots covering that refill period, each slot spread
+# over a few shards so a busy hook doesn't hammer a single cache key.
+SLOTS = 6
+NUM_SHARDS = 4
+
+# defaults for hooks, see EmailHook.rate_burst and rate_limit
+HOOK_BURST = 60
+HOOK_RATE = 60
+
+# per user, across all of their hooks
+USER_BURST = 300
+USER_RATE = 300
+
+
+class Bucket(object):
+    def __init__(self, name, burst, rate):
+        self.name = name
+        self.burst = burst
+        self.rate = rate
+
+        # seconds for an empty bucket to fill up again
+        self.period = max(1.0, 60.0 * burst / rate)
+        self.slot = self.period / SLOTS
+
+    def _key(self, slot, shard):
+        return 'rate:%s:%d:%d' % (self.name, slot, shard)
+
+    def spent(self, now):
+        current = int(now // self.slot)
+        keys = [self._key(slot, shard)
+                for slot in range(current - SLOTS + 1, current + 1)
+                for shard in range(NUM_SHARDS)]
+
+        return sum(cache.get_many(keys).values())
+
+    def allows(self, now):
+        return self.spent(now) < self.burst
+
+    def take(self, now):
+        key = self._key(int(now // self.slot),
+                        random.randint(0, NUM_SHARDS - 1))
+        timeout = int(self.period) + 60
+
+        cache.add(key, 0, timeout)
+        try:
+            cache.incr(key)
+        except ValueError:
+            # evicted in between
+            cache.set(key, 1, timeout)
+
+
+def hook_bucket(route):
+    return Bucket('hook:%s' % route.recipient,
+                  route.rate_burst or HOOK_BURST,
+                  route.rate_limit or HOOK_RATE)
+
+
+def user_bucket(user_id):
+    return Bucket('user:%s' % user_id, USER_BURST, USER_RATE)
+
+
+# Splits routes into (allowed, limited), taking a token from the hook's
+# and the user's bucket for every route that is allowed.
+def check(routes):
+    now = time.time()
+    allowed = []
+    limited = []
+
+    for route in routes:
+        buckets = [hook_bucket(route), user_bucket(route.user_id)]
+
+        if all(bucket.allows(now) for bucket in buckets):
+            for bucket in buckets:
+                bucket.take(now)
+            allowed.append(route)
+        else:
+            limited.append(route)
+
+    return allowed, limited
+
+
+# seconds until the limited routes have a token again, at the latest
+def retry_after(routes):
+    return max(max(hook_bucket(route).slot, user_bucket(route.user_id).slot)
+               for route in routes)
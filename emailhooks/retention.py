@@ -0,0 +1,105 @@
+import datetime
+import hashlib
+import logging
+
+from google.appengine.ext import deferred
+
+from djangoappengine.db.utils import get_cursor, set_cursor
+
+from .models import GoogleUser, LogEntry, LogSummary
+
+
+# Expires LogEntry rows older than each user's log_retention_days. Runs
+# daily from cron as a chain of deferred tasks, one batch per task, so
+# it keeps up no matter how many rows there are.
+BATCH_SIZE = 500
+
+# set to roll expired entries up into per-day LogSummary rows before
+# deleting them, which needs the whole entries instead of their keys
+SUMMARIZE = False
+
+
+def expire_all(cursor=None):
+    users = GoogleUser.objects.order_by('pk')
+    if cursor:
+        users = set_cursor(users, start=cursor)
+
+    batch = users[:BATCH_SIZE]
+    for user in batch:
+        deferred.defer(expire_user, user.user_id, user.log_retention_days)
+
+    if len(batch) == BATCH_SIZE:
+        deferred.defer(expire_all, get_cursor(batch))
+
+
+def expire_user(user_id, days, cursor=None):
+    horizon = datetime.datetime.now() - datetime.timedelta(days=days)
+
+    expired = LogEntry.objects.filter(
+        user_id=user_id, created__lt=horizon).order_by('created')
+    if cursor:
+        expired = set_cursor(expired, start=cursor)
+
+    if SUMMARIZE:
+        batch = expired[:BATCH_SIZE]
+        entries = list(batch)
+        keys = [entry.pk for entry in entries]
+        summarize(entries)
+    else:
+        batch = expired.values_list('pk', flat=True)[:BATCH_SIZE]
+        keys = list(batch)
+
+    if not keys:
+        return
+
+    LogEntry.objects.filter(pk__in=keys).delete()
+
+    logging.info('Expired %s log entries for %s', len(keys), user_id)
+
+    if len(keys) == BATCH_SIZE:
+        deferred.defer(expire_user, user_id, days, get_cursor(batch))
+
+
+# Entries come in (created, pk) order, and each summary remembers the
+# last one it counted, so running a batch again (say the task failed
+# after saving some of the summaries) doesn't count anything twice.
+def summarize(entries):
+    summaries = {}
+
+    for entry in entries:
+        day = entry.created.date()
+        key = '%s:%s:%s' % (
+            entry.user_id,
+            hashlib.sha1(u'%s %s' % (
+                entry.recipient, entry.destination)).hexdigest(),
+            day.isoformat())
+
+        summary = summaries.get(key)
+        if summary is None:
+            try:
+                summary = LogSummary.objects.get(pk=key)
+            except LogSummary.DoesNotExist:
+                summary = LogSummary(
+                    key=key,
+                    user_id=entry.user_id,
+                    recipient=entry.recipient,
+                    destination=entry.destination,
+                    day=day,
+                    statuses={})
+            summaries[key] = summary
+
+        if (summary.last_created is not None and
+                (entry.created, entry.pk) <=
+                (summary.last_created, summary.last_pk)):
+            continue
+
+        summary.last_created = entry.created
+        summary.last_pk = entry.pk
+
+        status = str(entry.status_code)
+        summary.count += 1
+        summary.size += int(entry.size or 0)
+        summary.statuses[status] = summary.statuses.get(status, 0) + 1
+
+    for summary in summaries.values():
+        summary.save()
@@ -0,0 +1,61 @@
+from .models import EmailHook, GoogleUser, HookRoute
+from .payload import profile_fields, split_fields
+
+
+def save_route(hook, user=None):
+    if user is None:
+        user = GoogleUser.objects.get(user_id=hook.user_id)
+
+    route = HookRoute(
+        recipient=hook.recipient,
+        user_id=user.user_id,
+        destination=hook.destination,
+        key=user.key,
+        offload_attachments=hook.offload_attachments,
+        compress_payload=hook.compress_payload,
+        fields=list(profile_fields(
+            hook.payload_profile, split_fields(hook.payload_fields))),
+        rate_burst=hook.rate_burst,
+        rate_limit=hook.rate_limit,
+        batch_deliveries=hook.batch_deliveries,
+        signature_algorithm=hook.signature_algorithm,
+        timestamp_signature=hook.timestamp_signature)
+
+    route.save()
+    return route
+
+
+def delete_route(recipient):
+    HookRoute.objects.filter(pk=recipient).delete()
+
+
+def save_user_routes(user):
+    for hook in EmailHook.objects.filter(user_id=user.user_id):
+        save_route(hook, user)
+
+
+# returns {recipient: HookRoute or None}, using one batch get
+def get_routes(recipients):
+    recipients = [r for r in recipients if r]
+    routes = dict((recipient, None) for recipient in recipients)
+
+    if not recipients:
+        return routes
+
+    for route in HookRoute.objects.filter(pk__in=recipients):
+        routes[route.pk] = route
+
+    # hooks that haven't been backfilled yet (see backfill_routes)
+    for recipient in recipients:
+        if routes[recipient] is None:
+            routes[recipient] = _route_from_hook(recipient)
+
+    return routes
+
+
+def _route_from_hook(recipient):
+    try:
+        hook = EmailHook.objects.get(recipient=recipient)
+        return save_route(hook)
+    except (EmailHook.DoesNotExist, GoogleUser.DoesNotExist):
+        return None
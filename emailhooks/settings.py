@@ -104,6 +104,7 @@ INSTALLED_APPS = (
     'djangotoolbox',
     'autoload',
     'dbindexer',
+    'emailhooks',
 
     # djangoappengine should come last, so it can override a few manage.py commands
     'djangoappengine',
@@ -112,3 +113,8 @@ INSTALLED_APPS = (
 LOGIN_URL = '/login'
 
 DEBUG = False
+
+# How webhook posts are sent. Off App Engine (or wherever outbound
+# sockets are available) 'emailhooks.transport.PooledTransport' keeps
+# connections to destinations alive between deliveries.
+DELIVERY_TRANSPORT = 'emailhooks.transport.UrlfetchTransport'
@@ -0,0 +1,65 @@
+import hashlib
+import hmac
+
+from .lru import LRUCache
+
+
+# Payload signatures. A Signer takes the payload a chunk at a time, so
+# the payload is never copied to be signed. Setting up the keyed HMAC
+# state (padding and hashing the key) is done once per key and cached;
+# every signature starts from a copy of it.
+ALGORITHMS = (
+    ('sha1', 'HMAC-SHA1'),
+    ('sha256', 'HMAC-SHA256'),
+)
+
+DIGESTS = {
+    'sha1': hashlib.sha1,
+    'sha256': hashlib.sha256,
+}
+
+KEYED_SIZE = 1000
+KEYED_TTL = 60 * 60
+
+_keyed = LRUCache(KEYED_SIZE, KEYED_TTL)
+
+
+def _keyed_hmac(key, algorithm):
+    state = _keyed.get((key, algorithm))
+
+    if state is None:
+        # hmac needs bytes (str() == bytes() in python 2.7)
+        state = hmac.new(bytes(key), digestmod=DIGESTS[algorithm])
+        _keyed.set((key, algorithm), state)
+
+    return state.copy()
+
+
+# With a timestamp, the signature covers "<timestamp>." followed by the
+# payload, and the timestamp is sent along in X-Hook-Timestamp.
+class Signer(object):
+    def __init__(self, key, algorithm='sha1', timestamp=None):
+        self.hmac = _keyed_hmac(key, algorithm)
+        self.timestamp = timestamp
+
+        if timestamp is not None:
+            self.hmac.update('%d.' % timestamp)
+
+    def update(self, chunk):
+        self.hmac.update(chunk)
+
+    def hexdigest(self):
+        return self.hmac.hexdigest()
+
+
+# what the signature for a route depends on; routes with the same spec
+# can share a signer
+def spec(route):
+    return (route.key,
+            route.signature_algorithm or 'sha1',
+            bool(route.timestamp_signature))
+
+
+def for_route(route, timestamp):
+    key, algorithm, timestamped = spec(route)
+    return Signer(key, algorithm, timestamp if timestamped else None)
@@ -0,0 +1,147 @@
+import datetime
+import logging
+import random
+
+from djangoappengine.db.utils import commit_locked
+
+from .models import HookStatShard
+
+
+# Per-hook delivery counters, bucketed by hour and spread over a few
+# shards so concurrent deliveries for a busy hook don't fight over one
+# entity. Shard keys are derived from (user, hook, hour, shard), so
+# reading a hook's numbers is a batch get, never a scan of LogEntry.
+NUM_SHARDS = 4
+
+# hours covered by the numbers shown in the hook list and logs
+WINDOW = 24
+
+# upper bounds (ms) of the latency histogram buckets, plus one more
+# bucket for everything slower
+LATENCY_BUCKETS = (50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000)
+
+
+def _hour(when):
+    return when.replace(minute=0, second=0, microsecond=0)
+
+
+def _key(user_id, recipient, hour, shard):
+    return '%s:%s:%s:%d' % (
+        user_id, recipient, hour.strftime('%Y%m%d%H'), shard)
+
+
+def status_class(status_code):
+    try:
+        return '%dxx' % (int(status_code) // 100)
+    except (TypeError, ValueError):
+        return 'ERR'
+
+
+def _bucket(latency):
+    for i, bound in enumerate(LATENCY_BUCKETS):
+        if latency <= bound:
+            return i
+    return len(LATENCY_BUCKETS)
+
+
+# count is the number of emails the delivery carried, see batching.py
+# Counters are best effort: errors (like contention on the shard) are
+# logged, never raised to the delivery that is being counted.
+def record(delivery, status_code, latency, delivered, count=1):
+    hour = _hour(datetime.datetime.now())
+    shard = random.randint(0, NUM_SHARDS - 1)
+    key = _key(delivery.user_id, delivery.recipient, hour, shard)
+
+    try:
+        _increment(key, delivery, hour, status_class(status_code),
+                   _bucket(int(latency * 1000)), delivered, count)
+    except Exception:
+        logging.exception('Could not record stats for %s', key)
+
+
+@commit_locked
+def _increment(key, delivery, hour, status, bucket, delivered, count):
+    try:
+        shard = HookStatShard.objects.get(pk=key)
+    except HookStatShard.DoesNotExist:
+        shard = HookStatShard(
+            key=key,
+            user_id=delivery.user_id,
+            recipient=delivery.recipient,
+            hour=hour,
+            statuses={},
+            latencies=[0] * (len(LATENCY_BUCKETS) + 1))
+
+    if delivered:
+        shard.delivered += count
+        shard.size += delivery.size
+        shard.attachments += delivery.num_attachments
+
+    shard.statuses[status] = shard.statuses.get(status, 0) + count
+    shard.latencies[bucket] += 1
+    shard.save()
+
+
+class HookStats(object):
+    def __init__(self):
+        self.delivered = 0
+        self.size = 0
+        self.attachments = 0
+        self.statuses = {}
+        self.latencies = [0] * (len(LATENCY_BUCKETS) + 1)
+
+    def add(self, shard):
+        self.delivered += shard.delivered
+        self.size += shard.size
+        self.attachments += shard.attachments
+
+        for status, count in shard.statuses.items():
+            self.statuses[status] = self.statuses.get(status, 0) + count
+
+        for i, count in enumerate(shard.latencies):
+            self.latencies[i] += count
+
+    @property
+    def failed(self):
+        return sum(count for status, count in self.statuses.items()
+                   if status not in ('2xx', '3xx'))
+
+    # upper bound of the bucket holding the given percentile, in ms
+    def percentile(self, p):
+        total = sum(self.latencies)
+        if not total:
+            return None
+
+        seen = 0
+        for i, count in enumerate(self.latencies):
+            seen += count
+            if seen >= total * p / 100.0:
+                # nothing is slower than the fetch deadline anyway
+                return LATENCY_BUCKETS[min(i, len(LATENCY_BUCKETS) - 1)]
+
+    @property
+    def p50(self):
+        return self.percentile(50)
+
+    @property
+    def p95(self):
+        return self.percentile(95)
+
+
+# returns {recipient: HookStats} over the last WINDOW hours
+def for_hooks(user_id, recipients):
+    now = _hour(datetime.datetime.now())
+    hours = [now - datetime.timedelta(hours=i) for i in range(WINDOW)]
+
+    keys = [_key(user_id, recipient, hour, shard)
+            for recipient in recipients
+            for hour in hours
+            for shard in range(NUM_SHARDS)]
+
+    stats = dict((recipient, HookStats()) for recipient in recipients)
+
+    if keys:
+        for shard in HookStatShard.objects.filter(pk__in=keys):
+            stats[shard.recipient].add(shard)
+
+    return stats
@@ -0,0 +1,8 @@
+from .test_breaker import BreakerTest
+from .test_delivery import DeliveryTest
+from .test_mime import MimeParserTest
+from .test_models import FindRecipientsTest
+from .test_payload import PayloadTest
+from .test_ratelimit import RateLimitTest
+from .test_signing import SignerTest
+from .test_transport import PooledTransportTest
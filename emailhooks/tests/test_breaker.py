@@ -0,0 +1,79 @@
+from django.test import SimpleTestCase
+
+from .. import breaker
+from .utils import FakeCache
+
+
+DESTINATION = 'https://example.com/hook'
+
+
+class BreakerTest(SimpleTestCase):
+
+    def setUp(self):
+        self.cache = FakeCache()
+        self.real_cache = breaker.cache
+        breaker.cache = self.cache
+
+    def tearDown(self):
+        breaker.cache = self.real_cache
+
+    def failures(self, times):
+        return [breaker.record_failure(DESTINATION) for _ in range(times)]
+
+    def test_opens_at_threshold(self):
+        below = breaker.FAILURE_THRESHOLD - 1
+
+        self.assertEqual(self.failures(below), [False] * below)
+        self.assertTrue(breaker.allow(DESTINATION))
+        self.assertFalse(breaker.is_tripped(DESTINATION))
+
+        self.assertEqual(self.failures(1), [True])
+        self.assertTrue(breaker.is_open(DESTINATION))
+        self.assertTrue(breaker.is_tripped(DESTINATION))
+        self.assertFalse(breaker.allow(DESTINATION))
+
+    def test_single_probe(self):
+        self.failures(breaker.FAILURE_THRESHOLD)
+
+        self.cache.now += breaker.COOLDOWN
+        self.assertFalse(breaker.is_open(DESTINATION))
+        self.assertTrue(breaker.allow(DESTINATION))
+        self.assertFalse(breaker.allow(DESTINATION))
+
+        # a failed probe opens the breaker again, for a whole cooldown
+        self.assertEqual(self.failures(1), [True])
+        self.assertFalse(breaker.allow(DESTINATION))
+
+        self.cache.now += breaker.COOLDOWN
+        self.assertTrue(breaker.allow(DESTINATION))
+
+    def test_success(self):
+        self.failures(breaker.FAILURE_THRESHOLD)
+        self.cache.now += breaker.COOLDOWN
+        breaker.allow(DESTINATION)
+
+        breaker.record_success(DESTINATION)
+        self.assertEqual(self.cache.entries, {})
+        self.assertTrue(breaker.allow(DESTINATION))
+        self.assertTrue(breaker.allow(DESTINATION))
+        self.assertEqual(self.failures(1), [False])
+
+    def test_failure_window(self):
+        below = breaker.FAILURE_THRESHOLD - 1
+        self.failures(below)
+
+        self.cache.now += breaker.FAILURE_WINDOW
+        self.assertEqual(self.failures(below), [False] * below)
+
+    def test_evicted_counter(self):
+        self.failures(2)
+        self.cache.add = lambda key, value, timeout=None: False
+        self.cache.evict(breaker._key('failures', DESTINATION))
+
+        self.assertEqual(self.failures(1), [False])
+        self.assertEqual(
+            self.cache.get(breaker._key('failures', DESTINATION)), 1)
+
+    def test_destinations(self):
+        self.failures(breaker.FAILURE_THRESHOLD)
+        self.assertTrue(breaker.allow('https://example.com/other'))
@@ -0,0 +1,165 @@
+from django.test import TestCase
+
+from .. import breaker, delivery
+from ..models import Delivery, LogEntry
+from .utils import FakeCache
+
+
+DESTINATION = 'https://example.com/hook'
+
+
+# the longest wait backoff() can pick
+class LongestWait(object):
+    @staticmethod
+    def uniform(low, high):
+        return high
+
+
+class FakeDelivery(object):
+    pk = 1
+    destination = DESTINATION
+    batch = []
+    parked = False
+
+    def __init__(self, attempts=1):
+        self.attempts = attempts
+        self.saved = 0
+
+    def save(self):
+        self.saved += 1
+
+
+class DeliveryTest(TestCase):
+
+    def setUp(self):
+        self.cache = FakeCache()
+        self.real_cache = breaker.cache
+        breaker.cache = self.cache
+
+        # what settle() and _drain() hand off to, by name
+        self.calls = []
+        for name in ('enqueue', 'done', 'schedule_drain', 'release'):
+            self.record(name)
+
+        self.replace('random', LongestWait)
+
+    def tearDown(self):
+        breaker.cache = self.real_cache
+
+    def replace(self, name, value):
+        self.addCleanup(setattr, delivery, name, getattr(delivery, name))
+        setattr(delivery, name, value)
+
+    def record(self, name, result=None):
+        def call(*args, **kwargs):
+            self.calls.append((name, args, kwargs))
+            return result
+
+        self.replace(name, call)
+
+    def called(self):
+        return [name for name, _, _ in self.calls]
+
+    def park_deliveries(self, count=1):
+        for _ in range(count):
+            Delivery.objects.create(
+                user_id='user', recipient='hook', destination=DESTINATION,
+                signature='', payload='{}', num_attachments=0, size=2,
+                parked=True)
+
+    def open_breaker(self):
+        for _ in range(breaker.FAILURE_THRESHOLD):
+            breaker.record_failure(DESTINATION)
+
+    def test_backoff(self):
+        self.assertEqual(delivery.backoff(0), delivery.BACKOFF_BASE)
+        self.assertEqual(delivery.backoff(3), delivery.BACKOFF_BASE * 8)
+        self.assertEqual(delivery.backoff(20), delivery.BACKOFF_CAP)
+
+    def test_delivered(self):
+        breaker.record_failure(DESTINATION)
+        delivered = FakeDelivery()
+        entry = LogEntry()
+
+        delivery.settle(delivered, entry, True)
+        self.assertEqual(self.calls, [('done', (delivered, entry), {})])
+        self.assertEqual(self.cache.entries, {})
+
+    def test_retry(self):
+        failed = FakeDelivery(attempts=2)
+
+        delivery.settle(failed, LogEntry(), False)
+        self.assertEqual(failed.saved, 1)
+        self.assertEqual(self.calls, [
+            ('enqueue', (failed,), {'countdown': delivery.BACKOFF_BASE * 4}),
+        ])
+
+    def test_park_on_open(self):
+        for _ in range(breaker.FAILURE_THRESHOLD - 1):
+            breaker.record_failure(DESTINATION)
+        self.record('park')
+        failed = FakeDelivery()
+
+        delivery.settle(failed, LogEntry(), False)
+        self.assertEqual(self.calls, [('park', (failed,), {})])
+        self.assertFalse(breaker.allow(DESTINATION))
+
+    def test_give_up(self):
+        delivery.settle(
+            FakeDelivery(attempts=delivery.MAX_ATTEMPTS), LogEntry(), False)
+        self.assertEqual(self.called(), ['done'])
+
+        # the last attempt opened the breaker, so whatever is parked
+        # still gets drained
+        self.calls = []
+        for _ in range(breaker.FAILURE_THRESHOLD - 2):
+            breaker.record_failure(DESTINATION)
+        delivery.settle(
+            FakeDelivery(attempts=delivery.MAX_ATTEMPTS), LogEntry(), False)
+        self.assertEqual(self.called(), ['done', 'schedule_drain'])
+
+    def test_park(self):
+        parked = FakeDelivery()
+
+        delivery.park(parked)
+        self.assertTrue(parked.parked)
+        self.assertEqual(parked.saved, 1)
+        self.assertEqual(self.calls, [('schedule_drain', (DESTINATION,), {})])
+
+    def test_drain_nothing_parked(self):
+        self.record('attempt', True)
+
+        delivery._drain(DESTINATION)
+        self.assertEqual(self.calls, [])
+
+    def test_drain_while_open(self):
+        self.park_deliveries()
+        self.open_breaker()
+        self.record('attempt', True)
+
+        delivery._drain(DESTINATION)
+        self.assertEqual(self.called(), ['schedule_drain'])
+
+    def test_drain(self):
+        self.park_deliveries(3)
+        self.open_breaker()
+        self.cache.now += breaker.COOLDOWN
+        self.record('attempt', True)
+
+        delivery._drain(DESTINATION)
+        self.assertEqual(self.called(), ['attempt', 'release'])
+        self.assertFalse(self.calls[0][1][0].parked)
+
+        # only the one probe while the breaker is half open
+        self.calls = []
+        delivery._drain(DESTINATION)
+        self.assertEqual(self.called(), ['schedule_drain'])
+
+    def test_drain_probe_fails(self):
+        self.park_deliveries()
+        self.open_breaker()
+        self.cache.now += breaker.COOLDOWN
+        self.record('attempt', False)
+
+        delivery._drain(DESTINATION)
+        self.assertEqual(self.called(), ['attempt', 'schedule_drain'])
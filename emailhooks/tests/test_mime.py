@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+import base64
+import email
+from email import quoprimime
+from email.header import Header
+from email.mime.application import MIMEApplication
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+
+from django.test import SimpleTestCase
+
+from .. import mime
+
+
+# the parser's events for a message, without the top level headers
+def parts(message, **kwargs):
+    return list(mime.parse(message, **kwargs).parts())
+
+
+def attachment_data(events):
+    return ''.join(event[1] for event in events if event[0] == mime.CHUNK)
+
+
+def attachment(data, filename, encoding=None):
+    part = MIMEApplication(data, 'octet-stream')
+    if encoding == 'quoted-printable':
+        del part['Content-Transfer-Encoding']
+        part['Content-Transfer-Encoding'] = encoding
+        part.set_payload(quoprimime.body_encode(data))
+    part.add_header('Content-Disposition', 'attachment', filename=filename)
+    return part
+
+
+# an attachment claiming to be base64, with the body as it is
+def raw_base64(body, filename='a.bin'):
+    part = MIMEApplication('', 'octet-stream')
+    part.set_payload(body)
+    part.add_header('Content-Disposition', 'attachment', filename=filename)
+    return part
+
+
+def message(*parts, **headers):
+    msg = MIMEMultipart('mixed')
+    msg['From'] = 'Sender <sender@example.com>'
+    msg['To'] = 'hook@emailhooks.xyz'
+    msg['Subject'] = headers.get('subject', 'Hello')
+    for part in parts:
+        msg.attach(part)
+    return msg.as_string()
+
+
+class MimeParserTest(SimpleTestCase):
+
+    def test_headers(self):
+        raw = ('From: sender@example.com\r\n'
+               'Subject: a subject\r\n'
+               '  that is folded\r\n'
+               'X-Other: value\r\n'
+               '\r\n'
+               'body\r\n')
+        self.assertEqual(mime.parse(raw).headers(), [
+            ('From', 'sender@example.com'),
+            ('Subject', 'a subject that is folded'),
+            ('X-Other', 'value'),
+        ])
+
+    def test_encoded_header(self):
+        value = Header(u'Grüße', 'utf-8').encode()
+        self.assertEqual(mime.decode_header_value(value), u'Grüße')
+        self.assertEqual(mime.decode_header_value('plain'), u'plain')
+
+    def test_nested_multipart(self):
+        alternative = MIMEMultipart('alternative')
+        alternative.attach(MIMEText('plain text', 'plain'))
+        alternative.attach(MIMEText('<p>html</p>', 'html'))
+        raw = message(alternative, attachment('data', 'a.bin'))
+
+        events = parts(raw)
+        self.assertEqual(events[:2], [
+            (mime.BODY, 'text/plain', u'plain text'),
+            (mime.BODY, 'text/html', u'<p>html</p>'),
+        ])
+        self.assertEqual(events[2], (mime.ATTACHMENT, 'a.bin',
+                                     'application/octet-stream'))
+        self.assertEqual(base64.b64decode(attachment_data(events)), 'data')
+
+    def test_missing_closing_boundary(self):
+        raw = ('Content-Type: multipart/mixed; boundary="XX"\r\n'
+               '\r\n'
+               '--XX\r\n'
+               'Content-Type: text/plain\r\n'
+               '\r\n'
+               'first\r\n'
+               '--XX\r\n'
+               'Content-Type: text/html\r\n'
+               '\r\n'
+               '<b>cut off</b>\r\n')
+        self.assertEqual(parts(raw), [
+            (mime.BODY, 'text/plain', u'first'),
+            (mime.BODY, 'text/html', u'<b>cut off</b>\r\n'),
+        ])
+
+    def test_base64_passthrough(self):
+        data = ''.join(chr(i % 256) for i in range(5000))
+        raw = message(attachment(data, 'bytes.bin'))
+
+        reference = email.message_from_string(raw).get_payload()[0]
+        self.assertEqual(attachment_data(parts(raw)),
+                         ''.join(reference.get_payload().split()))
+
+    def test_malformed_base64(self):
+        bodies = [
+            'AAAA"}], "sender": "evil@x.com", "x": [{"a": "',
+            'QUJD\r\nREVG\\"\r\nR0g=\r\n',
+            'QUI=\r\nQ0RF\r\n',
+            'QUJ\r\nDREVG\r\n',
+        ]
+
+        for body in bodies:
+            raw = message(raw_base64(body))
+            data = attachment_data(parts(raw))
+
+            reference = email.message_from_string(raw).get_payload()[0]
+            self.assertTrue(mime.BASE64_LINE.match(data.rstrip('=')), data)
+            self.assertEqual(base64.b64decode(data),
+                             reference.get_payload(decode=True))
+
+        # a character short of a byte
+        raw = message(raw_base64('QUJDR\r\n'))
+        self.assertEqual(attachment_data(parts(raw)), 'QUJD')
+
+    def test_quoted_printable_attachment(self):
+        data = 'caf\xe9 = 100%\nsecond line ' + 'x' * 200 + '\n'
+        raw = message(attachment(data, 'notes.txt', 'quoted-printable'))
+
+        reference = email.message_from_string(raw).get_payload()[0]
+        self.assertEqual(base64.b64decode(attachment_data(parts(raw))),
+                         reference.get_payload(decode=True))
+
+    def test_encoded_filename(self):
+        raw = message(attachment('data', Header(u'résumé.pdf',
+                                                'utf-8').encode()))
+        events = parts(raw)
+        self.assertEqual(events[0][:2], (mime.ATTACHMENT, u'résumé.pdf'))
+
+    def test_charsets(self):
+        latin = MIMEText(u'café'.encode('latin-1'), 'plain')
+        latin.set_charset('latin-1')
+        unknown = MIMEText('caf\xc3\xa9', 'html')
+        del unknown['Content-Type']
+        unknown['Content-Type'] = 'text/html; charset="x-unknown"'
+        raw = message(latin, unknown)
+
+        self.assertEqual(parts(raw), [
+            (mime.BODY, 'text/plain', u'café'),
+            (mime.BODY, 'text/html', u'café'),
+        ])
+
+    def test_skipped_parts(self):
+        raw = message(MIMEText('plain text', 'plain'),
+                      MIMEText('<p>html</p>', 'html'),
+                      attachment('data', 'a.bin'))
+
+        events = parts(raw, bodies=('text/html',), attachments=False)
+        self.assertEqual(events, [
+            (mime.BODY, 'text/html', u'<p>html</p>'),
+            (mime.ATTACHMENT, 'a.bin', 'application/octet-stream'),
+        ])
+
+    def test_chunks(self):
+        data = 'x' * (mime.CHUNK_SIZE * 2)
+        raw = message(attachment(data, 'big.txt', 'quoted-printable'))
+
+        chunks = [event[1] for event in parts(raw)
+                  if event[0] == mime.CHUNK]
+        self.assertTrue(len(chunks) > 1)
+        self.assertEqual(base64.b64decode(''.join(chunks)), data)
+
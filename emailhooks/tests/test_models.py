@@ -0,0 +1,42 @@
+from django.test import SimpleTestCase
+
+from ..models import find_recipients
+
+
+class FindRecipientsTest(SimpleTestCase):
+
+    def test_to_and_cc(self):
+        headers = [
+            ('Cc', 'c@emailhooks.xyz, other@example.com'),
+            ('To', 'Hook A <a@emailhooks.xyz>, b@emailhooks.xyz'),
+        ]
+        self.assertEqual(find_recipients(headers), ['a', 'b', 'c'])
+
+    def test_repeated(self):
+        headers = [
+            ('To', 'a@emailhooks.xyz, a@emailhooks.xyz'),
+            ('To', 'b@emailhooks.xyz'),
+            ('Cc', 'A <a@emailhooks.xyz>'),
+        ]
+        self.assertEqual(find_recipients(headers), ['a', 'b'])
+
+    def test_domain_case(self):
+        headers = [('To', 'a@EmailHooks.XYZ, b@emailhooks.xyz.example.com')]
+        self.assertEqual(find_recipients(headers), ['a'])
+
+    def test_forwarded_for(self):
+        received = ('Received: by 10.0.0.1 with SMTP id x; '
+                    'for <Fwd@emailhooks.xyz>; Mon, 1 Jul 2013 12:00:00')
+        headers = [
+            ('Received', received),
+            ('To', 'someone@example.com'),
+        ]
+        self.assertEqual(find_recipients(headers), ['fwd'])
+
+        # only when the message isn't addressed to a hook
+        headers.append(('Cc', 'a@emailhooks.xyz'))
+        self.assertEqual(find_recipients(headers), ['a'])
+
+    def test_none(self):
+        self.assertEqual(find_recipients([('To', 'a@example.com')]), [])
+        self.assertEqual(find_recipients([]), [])
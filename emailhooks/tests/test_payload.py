@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+import base64
+import gzip
+import json
+from StringIO import StringIO
+
+from django.test import SimpleTestCase
+
+from .. import mime
+from ..payload import compress, encode
+
+
+class FakeEmail(object):
+    sender = 'sender@example.com'
+    to = ['hook@emailhooks.xyz']
+    cc = []
+    date = 'Mon, 1 Jul 2013 12:00:00 +0000'
+    subject = u'Grüße'
+    html_body = u'<p>"quoted"</p>'
+    plain_body = u'line\nbreak'
+
+    def __init__(self):
+        self.attachments = [
+            {'filename': 'a.bin',
+             'payload': [base64.b64encode('abc'), base64.b64encode('def')]},
+            {'filename': 'b.pdf', 'payload': [], 'size': 200000,
+             'url': 'https://emailhooks.xyz/attachments/b.pdf'},
+        ]
+
+
+class PayloadTest(SimpleTestCase):
+
+    def test_encode(self):
+        payload = json.loads(''.join(encode(FakeEmail(), consume=False)))
+
+        self.assertEqual(payload['subject'], u'Grüße')
+        self.assertEqual(payload['html_body'], u'<p>"quoted"</p>')
+        self.assertEqual(payload['plain_body'], u'line\nbreak')
+        self.assertEqual(
+            base64.b64decode(payload['attachments'][0]['payload']),
+            'abcdef')
+        self.assertEqual(payload['attachments'][1], {
+            'filename': 'b.pdf', 'payload': ''})
+
+    def test_attachment_escaping(self):
+        raw = ('Content-Type: multipart/mixed; boundary="XX"\r\n'
+               '\r\n'
+               '--XX\r\n'
+               'Content-Type: application/octet-stream\r\n'
+               'Content-Transfer-Encoding: base64\r\n'
+               'Content-Disposition: attachment; filename="a.bin"\r\n'
+               '\r\n'
+               'AAAA"}], "sender": "evil@x.com", "x": [{"a": "\r\n'
+               '--XX--\r\n')
+        fake = FakeEmail()
+        fake.attachments = [{'filename': 'a.bin', 'payload': [
+            event[1] for event in mime.parse(raw) if event[0] == mime.CHUNK]}]
+
+        payload = json.loads(''.join(encode(fake)))
+        self.assertEqual(payload['sender'], 'sender@example.com')
+        self.assertEqual(sorted(payload), sorted([
+            'sender', 'to', 'cc', 'date', 'subject', 'html_body',
+            'plain_body', 'attachments']))
+        self.assertEqual(len(payload['attachments']), 1)
+
+    def test_consume(self):
+        fake = FakeEmail()
+
+        list(encode(fake, consume=False))
+        self.assertEqual(len(fake.attachments[0]['payload']), 2)
+
+        list(encode(fake))
+        self.assertEqual(fake.attachments[0]['payload'], [])
+
+    def test_offload(self):
+        payload = json.loads(''.join(encode(FakeEmail(), offload=True)))
+        self.assertEqual(payload['attachments'][1], {
+            'filename': 'b.pdf', 'size': 200000,
+            'url': 'https://emailhooks.xyz/attachments/b.pdf'})
+
+    def test_fields(self):
+        payload = json.loads(''.join(
+            encode(FakeEmail(), fields=('subject', 'attachments'))))
+        self.assertEqual(sorted(payload), ['attachments', 'subject'])
+
+        payload = json.loads(''.join(encode(FakeEmail(), fields=('to',))))
+        self.assertEqual(payload, {'to': ['hook@emailhooks.xyz']})
+
+    def test_compress(self):
+        chunks = list(encode(FakeEmail(), consume=False))
+        compressed = ''.join(compress(iter(chunks)))
+
+        self.assertEqual(
+            gzip.GzipFile(fileobj=StringIO(compressed)).read(),
+            ''.join(chunks))
@@ -0,0 +1,106 @@
+from django.test import SimpleTestCase
+
+from .. import ratelimit
+from ..ratelimit import Bucket
+from .utils import FakeCache
+
+
+class Clock(object):
+    now = 1000.0
+
+    def time(self):
+        return self.now
+
+
+class Route(object):
+    user_id = 'user'
+
+    def __init__(self, recipient, rate_burst, rate_limit):
+        self.recipient = recipient
+        self.rate_burst = rate_burst
+        self.rate_limit = rate_limit
+
+
+class RateLimitTest(SimpleTestCase):
+
+    def setUp(self):
+        self.cache = FakeCache()
+        self.real_cache = ratelimit.cache
+        ratelimit.cache = self.cache
+
+        self.clock = Clock()
+        self.real_time = ratelimit.time
+        ratelimit.time = self.clock
+
+    def tearDown(self):
+        ratelimit.cache = self.real_cache
+        ratelimit.time = self.real_time
+
+    def send(self, bucket, now):
+        if not bucket.allows(now):
+            return False
+
+        bucket.take(now)
+        return True
+
+    def test_burst(self):
+        # 6 messages, refilled over 6 seconds, in slots of a second
+        bucket = Bucket('hook', 6, 60)
+        self.assertEqual(bucket.period, 6)
+        self.assertEqual(bucket.slot, 1)
+
+        self.assertEqual([self.send(bucket, 1000) for _ in range(7)],
+                         [True] * 6 + [False])
+        self.assertEqual(bucket.spent(1000), 6)
+
+        # the burst is held until its slot falls out of the window
+        self.assertFalse(self.send(bucket, 1005.9))
+        self.assertTrue(self.send(bucket, 1006))
+
+    def test_released_a_slot_at_a_time(self):
+        bucket = Bucket('hook', 6, 60)
+
+        for second in range(6):
+            self.assertTrue(self.send(bucket, 1000 + second))
+        self.assertFalse(self.send(bucket, 1005.5))
+
+        # one slot later the oldest message no longer counts
+        self.assertTrue(self.send(bucket, 1006))
+        self.assertFalse(self.send(bucket, 1006.5))
+        self.assertTrue(self.send(bucket, 1007))
+
+    def test_evicted_shard(self):
+        bucket = Bucket('hook', 6, 60)
+        self.cache.add = lambda key, value, timeout=None: False
+
+        bucket.take(1000)
+        self.assertEqual(bucket.spent(1000), 1)
+
+    def test_check(self):
+        small = Route('small', 2, 60)
+        big = Route('big', 100, 100)
+
+        results = [ratelimit.check([small, big]) for _ in range(3)]
+        self.assertEqual(results, [
+            ([small, big], []),
+            ([small, big], []),
+            ([big], [small]),
+        ])
+
+        # a limited hook doesn't use up the user's tokens
+        self.assertEqual(
+            ratelimit.user_bucket('user').spent(self.clock.now), 5)
+
+        self.clock.now += ratelimit.hook_bucket(small).period
+        self.assertEqual(ratelimit.check([small]), ([small], []))
+
+    def test_user_limit(self):
+        routes = [Route('hook%d' % i, 100, 100) for i in range(4)]
+        user = ratelimit.USER_BURST
+
+        allowed = 0
+        for i in range(user + 10):
+            if ratelimit.check([routes[i % 4]])[0]:
+                allowed += 1
+
+        self.assertEqual(allowed, user)
@@ -0,0 +1,49 @@
+import hashlib
+import hmac
+
+from django.test import SimpleTestCase
+
+from .. import signing
+from ..signing import Signer
+
+
+class SignerTest(SimpleTestCase):
+
+    def sign(self, signer, *chunks):
+        for chunk in chunks:
+            signer.update(chunk)
+        return signer.hexdigest()
+
+    def test_signature(self):
+        body = '{"subject": "Hello"}'
+
+        for algorithm in ('sha1', 'sha256'):
+            digestmod = signing.DIGESTS[algorithm]
+
+            self.assertEqual(
+                self.sign(Signer('key', algorithm), body[:5], body[5:]),
+                hmac.new('key', body, digestmod).hexdigest())
+
+            self.assertEqual(
+                self.sign(Signer('key', algorithm, 1372680000), body),
+                hmac.new('key', '1372680000.' + body, digestmod).hexdigest())
+
+    def test_cached_state(self):
+        signing._keyed.delete(('cached', 'sha256'))
+
+        first = Signer('cached', 'sha256')
+        second = Signer('cached', 'sha256', 1372680000)
+        first.update('one')
+        second.update('two')
+
+        # signers with the same key start from the same state, but
+        # don't share it
+        self.assertEqual(
+            first.hexdigest(),
+            hmac.new('cached', 'one', hashlib.sha256).hexdigest())
+        self.assertEqual(
+            second.hexdigest(),
+            hmac.new('cached', '1372680000.two', hashlib.sha256).hexdigest())
+        self.assertEqual(
+            self.sign(Signer('cached', 'sha256'), 'three'),
+            hmac.new('cached', 'three', hashlib.sha256).hexdigest())
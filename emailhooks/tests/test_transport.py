@@ -0,0 +1,88 @@
+import threading
+import time
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+
+from django.test import SimpleTestCase
+
+from ..transport import PooledTransport, TransportError
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        self.server.posts.append(body)
+
+        if self.server.delay:
+            time.sleep(self.server.delay)
+
+        self.send_response(200)
+        self.send_header('Content-Length', '2')
+        self.end_headers()
+        self.wfile.write('ok')
+
+        # hang up without saying so, like a server timing out an idle
+        # keep-alive connection
+        if self.server.hang_up:
+            self.close_connection = 1
+
+    def log_message(self, *args):
+        pass
+
+
+class Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class PooledTransportTest(SimpleTestCase):
+
+    def setUp(self):
+        self.server = Server(('127.0.0.1', 0), Handler)
+        self.server.posts = []
+        self.server.delay = 0
+        self.server.hang_up = False
+
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+        self.url = 'http://127.0.0.1:%d/hook' % self.server.server_port
+        self.transport = PooledTransport()
+
+    def tearDown(self):
+        self.transport.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def post(self, payload, deadline=5):
+        call = self.transport.start(self.url, payload, {}, deadline)
+        return self.transport.result(call)
+
+    def test_reuse(self):
+        self.assertEqual(self.post('one').content, 'ok')
+        self.assertEqual(self.post('two').content, 'ok')
+
+        self.assertEqual(self.server.posts, ['one', 'two'])
+        pool = self.transport.pools.values()[0]
+        self.assertEqual(len(pool), 1)
+
+    def test_closed_connection(self):
+        self.server.hang_up = True
+        self.post('one')
+
+        # sent again on a new connection, the first one never got there
+        self.assertEqual(self.post('two').status_code, 200)
+        self.assertEqual(self.server.posts, ['one', 'two'])
+
+    def test_timeout(self):
+        self.post('one')
+
+        self.server.delay = 1
+        start = time.time()
+        with self.assertRaises(TransportError):
+            self.post('two', deadline=0.3)
+
+        self.assertTrue(time.time() - start < 0.6)
+        self.assertEqual(self.server.posts, ['one', 'two'])
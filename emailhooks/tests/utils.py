@@ -0,0 +1,58 @@
+# Stands in for django.core.cache.cache in the modules under test, with
+# memcache's add/incr semantics. Time only moves when a test moves it,
+# by setting `now`.
+class FakeCache(object):
+    def __init__(self):
+        self.now = 0
+        self.entries = {}
+
+    def _alive(self, key):
+        if key not in self.entries:
+            return False
+
+        value, expires = self.entries[key]
+        if expires is not None and expires <= self.now:
+            del self.entries[key]
+            return False
+
+        return True
+
+    def get(self, key, default=None):
+        if not self._alive(key):
+            return default
+
+        return self.entries[key][0]
+
+    def get_many(self, keys):
+        return dict((key, self.entries[key][0])
+                    for key in keys if self._alive(key))
+
+    def set(self, key, value, timeout=None):
+        expires = self.now + timeout if timeout else None
+        self.entries[key] = (value, expires)
+
+    def add(self, key, value, timeout=None):
+        if self._alive(key):
+            return False
+
+        self.set(key, value, timeout)
+        return True
+
+    def incr(self, key, delta=1):
+        if not self._alive(key):
+            raise ValueError('Key %r not found' % key)
+
+        value, expires = self.entries[key]
+        self.entries[key] = (value + delta, expires)
+        return value + delta
+
+    def delete(self, key):
+        self.entries.pop(key, None)
+
+    def delete_many(self, keys):
+        for key in keys:
+            self.delete(key)
+
+    # drops a key, as memcache may at any time
+    def evict(self, key):
+        self.delete(key)
@@ -0,0 +1,219 @@
+import errno
+import httplib
+import socket
+import threading
+import time
+import urlparse
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.urlresolvers import get_callable
+
+
+# How deliveries are POSTed, see settings.DELIVERY_TRANSPORT. A transport
+# starts a request and hands back a call, which result() turns into a
+# response with status_code and content. Transports that can overlap
+# requests (urlfetch) start them straight away, the others only send
+# them once the result is asked for.
+DEFAULT_TRANSPORT = 'emailhooks.transport.UrlfetchTransport'
+
+
+# Errors sending a request on a reused connection that mean the other
+# end had already closed it, so the request never got there and can be
+# sent again: no status line at all (older httplibs report the empty
+# line they read), or the connection reset before anything came back.
+NO_STATUS_LINE = ("''", 'No status line received')
+CLOSED_ERRNOS = (errno.ECONNRESET, errno.ECONNABORTED, errno.EPIPE)
+
+
+class TransportError(Exception):
+    pass
+
+
+class Response(object):
+    def __init__(self, status_code, content):
+        self.status_code = status_code
+        self.content = content
+
+
+class UrlfetchTransport(object):
+    def start(self, url, payload, headers, deadline):
+        # imported here so the other transports work off App Engine
+        from google.appengine.api import urlfetch
+
+        rpc = urlfetch.create_rpc(deadline=deadline)
+
+        try:
+            urlfetch.make_fetch_call(
+                rpc,
+                url=url,
+                headers=headers,
+                payload=payload,
+                method=urlfetch.POST)
+        except urlfetch.Error as err:
+            raise TransportError(err)
+
+        return rpc
+
+    def result(self, rpc):
+        from google.appengine.api import urlfetch
+
+        try:
+            return rpc.get_result()
+        except urlfetch.Error as err:
+            raise TransportError(err)
+
+
+# Keeps connections open between deliveries, up to max_per_host idle
+# connections for each of the max_hosts most recently used hosts.
+# Connections that sat idle for longer than idle_timeout are closed
+# instead of reused, as the other end has likely given up on them.
+class PooledTransport(object):
+    def __init__(self, max_per_host=4, max_hosts=100, idle_timeout=60):
+        self.max_per_host = max_per_host
+        self.max_hosts = max_hosts
+        self.idle_timeout = idle_timeout
+        self.pools = OrderedDict()
+        self.lock = threading.Lock()
+
+    def start(self, url, payload, headers, deadline):
+        parts = urlparse.urlsplit(url)
+
+        if parts.scheme not in ('http', 'https') or not parts.hostname:
+            raise TransportError('Unsupported url: %s' % url)
+
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+
+        host = (parts.scheme, parts.hostname, parts.port)
+        return host, path, payload, headers, deadline
+
+    def result(self, call):
+        host, path, payload, headers, deadline = call
+
+        conn, reused = self._acquire(host, deadline)
+
+        try:
+            try:
+                response = self._send(conn, path, payload, headers)
+            except (httplib.HTTPException, socket.error) as err:
+                # The other end may have closed an idle connection on
+                # us. Anything else, timeouts in particular, may have
+                # reached it, and is not sent twice.
+                if not (reused and _never_received(err)):
+                    raise
+
+                conn.close()
+                conn = self._connect(host, deadline)
+                response = self._send(conn, path, payload, headers)
+
+            content = response.read()
+        except (httplib.HTTPException, socket.error) as err:
+            conn.close()
+            raise TransportError(err)
+
+        if response.will_close:
+            conn.close()
+        else:
+            self._release(host, conn)
+
+        return Response(response.status, content)
+
+    # sends the request and reads up to the response headers
+    def _send(self, conn, path, payload, headers):
+        conn.request('POST', path, payload, headers)
+        return conn.getresponse()
+
+    def _connect(self, host, deadline):
+        scheme, hostname, port = host
+
+        if scheme == 'https':
+            return httplib.HTTPSConnection(hostname, port, timeout=deadline)
+        return httplib.HTTPConnection(hostname, port, timeout=deadline)
+
+    def _acquire(self, host, deadline):
+        now = time.time()
+        stale = []
+        conn = None
+
+        with self.lock:
+            pool = self.pools.pop(host, [])
+
+            while pool:
+                candidate, idle_since = pool.pop()
+                if now - idle_since > self.idle_timeout:
+                    stale.append(candidate)
+                else:
+                    conn = candidate
+                    break
+
+            # re-insert to mark as most recently used
+            self.pools[host] = pool
+
+        for candidate in stale:
+            candidate.close()
+
+        if conn is None:
+            return self._connect(host, deadline), False
+
+        conn.timeout = deadline
+        if conn.sock is not None:
+            conn.sock.settimeout(deadline)
+
+        return conn, True
+
+    def _release(self, host, conn):
+        evicted = []
+
+        with self.lock:
+            pool = self.pools.pop(host, [])
+
+            if len(pool) < self.max_per_host:
+                pool.append((conn, time.time()))
+            else:
+                evicted.append(conn)
+
+            self.pools[host] = pool
+
+            while len(self.pools) > self.max_hosts:
+                _, pool = self.pools.popitem(last=False)
+                evicted += [c for c, _ in pool]
+
+        for conn in evicted:
+            conn.close()
+
+    def close(self):
+        with self.lock:
+            pools, self.pools = self.pools, OrderedDict()
+
+        for pool in pools.values():
+            for conn, _ in pool:
+                conn.close()
+
+
+def _never_received(err):
+    if isinstance(err, httplib.BadStatusLine):
+        return err.line.startswith(NO_STATUS_LINE)
+
+    if isinstance(err, socket.timeout):
+        return False
+
+    return isinstance(err, socket.error) and err.errno in CLOSED_ERRNOS
+
+
+_transport = None
+_transport_lock = threading.Lock()
+
+
+# the configured transport, shared by the whole instance so its
+# connections are too
+def get_transport():
+    global _transport
+
+    with _transport_lock:
+        if _transport is None:
+            path = getattr(settings, 'DELIVERY_TRANSPORT', DEFAULT_TRANSPORT)
+            _transport = get_callable(path)()
+
+    return _transport
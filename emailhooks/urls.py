@@ -19,5 +19,10 @@ urlpatterns = [
     url(r'^hooks/logs/(?P<recipient>[-\w]+)/$',
         views.hook_logs, name='hook_logs'),
 
+    url(r'^attachments/(?P<name>.+)$',
+        views.attachment, name='attachment'),
+
+    url(r'^tasks/log-retention/$', views.log_retention),
+
     url(r'^_ah/mail/', views.email_handler),
 ]
@@ -1,23 +1,36 @@
 import logging
-import hmac
-import hashlib
+import mimetypes
 
+from django.conf import settings
 from django.contrib import auth
 from django.contrib.auth.decorators import login_required
 from django.views.decorators.csrf import csrf_exempt
-from django.http import HttpResponse
-from django.core import paginator
-from django.core.urlresolvers import reverse
+from django.http import HttpResponse, Http404
+from django.core.paginator import InvalidPage
+from django.core.files.storage import default_storage
+from django.core.urlresolvers import reverse, get_callable
 from django.shortcuts import render, redirect, get_object_or_404
-from django.utils.text import Truncator
-from django.template.defaultfilters import filesizeformat
 
-from google.appengine.api import urlfetch, users
+from google.appengine.api import users
+from google.appengine.ext import deferred
 
-from .models import EmailHook, Email, LogEntry, GoogleUser
+from djangoappengine.paginator import CursorPaginator
+
+from .models import EmailHook, LogEntry, peek_recipients
+from . import attachments, dedup, inbound, stats
+from .hookcache import get_routes
+from .retention import expire_all
+from .routing import save_route, delete_route
 from forms import EmailHookForm
 
 
+# inbound messages bigger than this are dropped
+MAX_EMAIL_SIZE = 500 * 1000
+
+# ...unless every hook they go to offloads its attachments
+MAX_OFFLOAD_EMAIL_SIZE = 10 * 1000 * 1000
+
+
 def home(request):
     return render(request, 'home.html')
 
@@ -43,7 +56,14 @@ def login(request):
 
 @login_required
 def hook_list(request):
-    hooks = EmailHook.objects.filter(user_id=request.user.user_id)
+    hooks = list(EmailHook.objects.filter(user_id=request.user.user_id))
+
+    hook_stats = stats.for_hooks(
+        request.user.user_id, [hook.recipient for hook in hooks])
+
+    for hook in hooks:
+        hook.stats = hook_stats[hook.recipient]
+
     return render(request, 'hook_list.html', {'hooks': hooks})
 
 
@@ -59,9 +79,19 @@ def hook_add(request):
         hook = EmailHook(
             user_id=request.user.user_id,
             recipient=form.cleaned_data['recipient'],
-            destination=form.cleaned_data['destination'])
+            destination=form.cleaned_data['destination'],
+            offload_attachments=form.cleaned_data['offload_attachments'],
+            compress_payload=form.cleaned_data['compress_payload'],
+            payload_profile=form.cleaned_data['payload_profile'],
+            payload_fields=form.cleaned_data['payload_fields'],
+            rate_burst=form.cleaned_data['rate_burst'],
+            rate_limit=form.cleaned_data['rate_limit'],
+            batch_deliveries=form.cleaned_data['batch_deliveries'],
+            signature_algorithm=form.cleaned_data['signature_algorithm'],
+            timestamp_signature=form.cleaned_data['timestamp_signature'])
 
         hook.save()
+        save_route(hook, request.user)
         return redirect('hook_list')
 
     return render(request, 'hook_add.html', {'form': form})
@@ -76,6 +106,7 @@ def hook_delete(request):
             recipient=request.POST.get('recipient'))
 
         hook.delete()
+        delete_route(hook.recipient)
 
     return redirect('hook_list')
 
@@ -91,6 +122,12 @@ def hook_edit(request, recipient):
 
     if request.method == 'POST' and form.is_valid():
         form.save()
+
+        # the recipient may have been renamed
+        if (hook.recipient != recipient):
+            delete_route(recipient)
+
+        save_route(hook, request.user)
         return redirect('hook_list')
 
     return render(request, 'hook_edit.html', {'form': form})
@@ -109,83 +146,79 @@ def hook_logs(request, recipient):
         destination=hook.destination,
         user_id=request.user.user_id)
 
-    pager = paginator.Paginator(all_logs, 25)
+    pager = CursorPaginator(all_logs, 25)
 
     try:
         logs = pager.page(request.GET.get('page'))
-    except paginator.PageNotAnInteger:
-        logs = pager.page(1)
-    except paginator.EmptyPage:
-        logs = pager.page(pager.num_pages)
+    except InvalidPage:
+        logs = pager.page()
+
+    hook_stats = stats.for_hooks(request.user.user_id, [recipient])
 
     return render(request, 'hook_logs.html', {
+        'stats': hook_stats[recipient],
         'logs': logs,
         'recipient': recipient,
         'destination': hook.destination
     })
 
 
+# download links for offloaded attachments, see attachments.py
+def attachment(request, name):
+    if not attachments.verify(
+            name, request.GET.get('expires'), request.GET.get('signature')):
+        raise Http404
+
+    try:
+        blob = default_storage.open(name)
+    except Exception:
+        raise Http404
+
+    filename = name.split('/', 1)[-1]
+    serve_file = get_callable(settings.SERVE_FILE_BACKEND)
+
+    return serve_file(
+        request, blob,
+        save_as=filename,
+        content_type=mimetypes.guess_type(filename)[0] or
+        'application/octet-stream')
+
+
+# run daily from cron.yaml
+def log_retention(request):
+    deferred.defer(expire_all)
+    deferred.defer(dedup.expire)
+    return HttpResponse()
+
+
 @csrf_exempt
 def email_handler(request):
-    if (len(request.body) > 500 * 1000):
+    if (len(request.body) > MAX_OFFLOAD_EMAIL_SIZE):
         logging.error('Email too big (%s), ignoring', len(request.body))
         return
 
-    # parse email from request body
-    email = Email(request.body)
+    # Most inbound mail is for recipients without a hook, so find out
+    # who it's for from the headers alone before parsing anything else.
+    recipients = peek_recipients(request.body)
 
-    logging.info('Incoming message for recipient: %s', email.recipient)
+    logging.info('Incoming message for recipients: %s', recipients)
 
-    # get associated hook, if it exists, and its user
-    hook = get_object_or_404(EmailHook, recipient=email.recipient)
-    user = get_object_or_404(GoogleUser, user_id=hook.user_id)
+    # get the routes for the associated hooks, if any exist
+    routes = get_routes(recipients)
 
-    payload = email.payload()
-    size = len(payload)
+    # big emails only go to the hooks that won't get them inline
+    if len(request.body) > MAX_EMAIL_SIZE:
+        routes = [route for route in routes if route.offload_attachments]
+        logging.info('Email is big (%s), only offloading hooks get it',
+                     len(request.body))
 
-    # hmac needs bytes (str() == bytes() in python 2.7)
-    signature = hmac.new(
-        bytes(user.key),
-        bytes(payload),
-        hashlib.sha1).hexdigest()
+    if not routes:
+        raise Http404
 
-    logging.info('Message matched to user: %s', user.email)
     logging.info(
-        '%s attachments, request is about ~%s',
-        len(email.attachments),
-        filesizeformat(size))
-
-    # keep log of the outgoing request
-    entry = LogEntry(
-        user_id=user.user_id,
-        recipient=email.recipient,
-        destination=hook.destination,
-        num_attachments=len(email.attachments),
-        size=size)
-
-    # try to post to destination
-    try:
-        url = hook.destination
-        headers = {
-            'Content-Type': 'application/json',
-            'X-Hook-Signature': signature,
-        }
-
-        result = urlfetch.fetch(
-            url=url,
-            headers=headers,
-            payload=payload,
-            method=urlfetch.POST)
-
-        entry.status_code = result.status_code
-        entry.response = Truncator(result.content).chars(100)
-
-        if (result.content == ''):
-            entry.response = 'N/A'
+        'Message matched to users: %s',
+        ', '.join(set(route.user_id for route in routes)))
 
-        logging.info('Returned %s : %s', entry.status_code, entry.response)
-    except urlfetch.Error as err:
-        logging.exception('urlfetch error: %s', err)
+    inbound.handle(request.body, routes, request.build_absolute_uri('/'))
 
-    entry.save()
     return HttpResponse()